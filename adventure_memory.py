@@ -0,0 +1,95 @@
+import os
+import re
+
+# The adventure history given to every prompt, kept within a token budget.
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+DEFAULT_MAX_EXCHANGES = int(os.getenv("ADVENTURE_MEMORY_EXCHANGES", 3))
+DEFAULT_TOKEN_BUDGET = int(os.getenv("ADVENTURE_MEMORY_TOKENS", 400))
+
+
+def estimate_tokens(text):
+    """
+    Rough token count (about four characters per token), good enough for budgeting prompts.
+    """
+    return (len(text) + 3) // 4
+
+
+def first_sentence(text):
+    text = " ".join(text.split())
+    return _SENTENCE_END.split(text, maxsplit=1)[0] if text else ""
+
+
+class AdventureMemory:
+    """
+    Drop-in replacement for ConversationBufferMemory as used by the narrative chains.
+    """
+
+    def __init__(self, memory_key="adventure_history", max_exchanges=DEFAULT_MAX_EXCHANGES, token_budget=DEFAULT_TOKEN_BUDGET, summary=None, exchanges=None):
+        self.memory_key = memory_key
+        self.max_exchanges = max_exchanges
+        self.token_budget = token_budget
+        self.summary = summary or ""
+        self.exchanges = list(exchanges or [])  # (input, output) pairs, oldest first
+
+    @property
+    def memory_variables(self):
+        return [self.memory_key]
+
+    def load_memory_variables(self, inputs):
+        return {self.memory_key: self.buffer}
+
+    @property
+    def buffer(self):
+        lines = []
+        if self.summary:
+            lines.append(f"Story so far: {self.summary}")
+        for human, ai in self.exchanges:
+            lines.append(f"Human: {human}\nAI: {ai}")
+        return "\n".join(lines)
+
+    def save_context(self, inputs, outputs):
+        human = " ".join(str(value) for value in inputs.values())
+        ai = " ".join(str(value) for value in outputs.values())
+        self.exchanges.append((human, ai))
+        while len(self.exchanges) > self.max_exchanges:
+            self._roll_up(*self.exchanges.pop(0))
+        self._enforce_budget()
+
+    def _roll_up(self, human, ai):
+        # Only the first sentence of an old reply is kept in the summary
+        sentence = first_sentence(ai)
+        if sentence:
+            self.summary = f"{self.summary} {sentence}".strip()
+
+    def _enforce_budget(self):
+        # Fold the oldest verbatim exchanges first, then drop the oldest part of the summary,
+        # and as a last resort cut the start of the one remaining reply
+        while len(self.exchanges) > 1 and estimate_tokens(self.buffer) > self.token_budget:
+            self._roll_up(*self.exchanges.pop(0))
+        overflow = estimate_tokens(self.buffer) - self.token_budget
+        if overflow > 0 and self.summary:
+            self.summary = self.summary[overflow * 4:]
+            cut = self.summary.find(" ")
+            self.summary = self.summary[cut + 1:] if cut != -1 else ""
+        overflow = estimate_tokens(self.buffer) - self.token_budget
+        if overflow > 0 and self.exchanges:
+            human, ai = self.exchanges[0]
+            self.exchanges[0] = (human, ai[overflow * 4:])
+
+    def clear(self):
+        self.summary = ""
+        self.exchanges = []
+
+    def to_dict(self):
+        return {
+            'summary': self.summary,
+            'exchanges': [{'input': human, 'output': ai} for human, ai in self.exchanges],
+        }
+
+    @staticmethod
+    def from_dict(data, **kwargs):
+        data = data or {}
+        exchanges = [(entry.get('input', ""), entry.get('output', "")) for entry in data.get('exchanges', [])]
+        return AdventureMemory(summary=data.get('summary', ""), exchanges=exchanges, **kwargs)
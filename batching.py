@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# At peak many players hit /continue within the same second, each needing its own generation.
+# The coalescer holds new requests for a short window, groups the ones with the same sampling parameters
+# and sends each group as one batched inference request, then hands every waiting caller its own result.
+
+
+class PendingGeneration:
+    def __init__(self, prompt, temperature, max_new_tokens):
+        self.prompt = prompt
+        self.temperature = temperature
+        self.max_new_tokens = max_new_tokens
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class RequestCoalescer:
+    """
+    Collects generations for window seconds (or until max_batch_size are waiting) and passes each group
+    with identical parameters to send_batch(prompts, temperature, max_new_tokens), which returns the
+    outputs in order. Temperatures are rounded to one decimal so nearby requests can share a batch.
+    Up to dispatch_workers groups are sent at once; each send blocks one dispatcher thread.
+    While requests keep coming, metrics() is printed every report_interval seconds (0 to turn it off).
+    """
+
+    def __init__(self, send_batch, window=0.03, max_batch_size=16, dispatch_workers=16, name="llm",
+                 report_interval=300):
+        self.send_batch = send_batch
+        self.name = name
+        self.report_interval = report_interval
+        self._reported_at = time.monotonic()
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._pending = []
+        self._condition = threading.Condition()
+        self._dispatcher = ThreadPoolExecutor(max_workers=dispatch_workers, thread_name_prefix="llm-batch")
+        # Metrics for tuning the window
+        self._metrics_lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.batch_sizes = Counter()
+        self.total_queue_delay = 0.0
+        self.max_queue_delay = 0.0
+        self._thread = threading.Thread(target=self._collect, name="llm-coalescer", daemon=True)
+        self._thread.start()
+
+    def submit(self, prompt, temperature, max_new_tokens):
+        pending = PendingGeneration(prompt, round(temperature, 1), max_new_tokens)
+        with self._condition:
+            self._pending.append(pending)
+            self._condition.notify()
+        return pending.future
+
+    def _collect(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                # Hold the window open from the oldest request, or until a full batch is waiting
+                closes_at = self._pending[0].enqueued_at + self.window
+                while len(self._pending) < self.max_batch_size:
+                    remaining = closes_at - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                taken, self._pending = self._pending[:self.max_batch_size], self._pending[self.max_batch_size:]
+
+            groups = {}
+            for pending in taken:
+                groups.setdefault((pending.temperature, pending.max_new_tokens), []).append(pending)
+            for (temperature, max_new_tokens), group in groups.items():
+                self._dispatcher.submit(self._dispatch, group, temperature, max_new_tokens)
+
+            if self.report_interval and time.monotonic() - self._reported_at >= self.report_interval:
+                self._reported_at = time.monotonic()
+                print(f"Batching metrics for {self.name}: {self.metrics()}")
+
+    def _dispatch(self, group, temperature, max_new_tokens):
+        # Skip requests whose caller already gave up on them (e.g. a discarded prefetch)
+        group = [pending for pending in group if pending.future.set_running_or_notify_cancel()]
+        if not group:
+            return
+        now = time.monotonic()
+        delays = [now - pending.enqueued_at for pending in group]
+        with self._metrics_lock:
+            self.batches += 1
+            self.requests += len(group)
+            self.batch_sizes[len(group)] += 1
+            self.total_queue_delay += sum(delays)
+            self.max_queue_delay = max(self.max_queue_delay, *delays)
+        try:
+            outputs = self.send_batch([pending.prompt for pending in group], temperature, max_new_tokens)
+        except Exception as e:
+            for pending in group:
+                pending.future.set_exception(e)
+            return
+        for pending, output in zip(group, outputs):
+            pending.future.set_result(output)
+
+    def metrics(self):
+        with self._metrics_lock:
+            return {
+                'batches': self.batches,
+                'requests': self.requests,
+                'mean_batch_size': self.requests / self.batches if self.batches else 0.0,
+                'batch_sizes': dict(self.batch_sizes),
+                'mean_queue_delay': self.total_queue_delay / self.requests if self.requests else 0.0,
+                'max_queue_delay': self.max_queue_delay,
+            }
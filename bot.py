@@ -2,16 +2,23 @@ import os
 import discord
 from discord import app_commands
 from dotenv import load_dotenv, find_dotenv
-from firebase_admin import initialize_app, credentials, firestore
+from firebase_admin import initialize_app, credentials, firestore_async
 import traceback
+from contextlib import aclosing
 
 from player import Player
 from dungeon import Dungeon
-from treasure import Treasure
-from shop import Shop, Item
+from shop import shop_catalog
+from executor import llm_pool, interaction_deadline, InteractionExpired
+from llm import batching_metrics
+from streaming import StreamedReply
+from session import UnitOfWork, StaleWrite
+from session_cache import sessions, command_queue
+from inventory_view import InventoryView, inventory_pages
 
 load_dotenv()
 TOKEN = os.getenv("TOKEN")
+STREAM_NARRATIVES = os.getenv("STREAM_NARRATIVES", "1") == "1"  # edit the reply as the narrative is generated
 
 # Initialise Firebase
 cred = credentials.Certificate("firebase.json")  # Add the path to your Firebase service account key
@@ -34,24 +41,52 @@ class DungeonBot(discord.Client):
         print(f'We have logged in as {self.user}')
 
 
+async def play(interaction, narrative, db):
+    """
+    Run a dungeon narrative generator on the llm pool and show its text to the player,
+    either progressively as it is generated or in one message once it is complete.
+    If the narrative does not finish, the user's cached session is dropped: the generator stopped part way
+    through a room and left the Player and Dungeon in a state that was never committed.
+    """
+    try:
+        # Closing the stream waits for the worker, so nothing else runs on these objects while it still does
+        async with aclosing(llm_pool.stream(narrative, db, deadline=interaction_deadline(interaction))) as chunks:
+            if STREAM_NARRATIVES:
+                return await StreamedReply(interaction).relay(chunks)
+            response = "".join([chunk async for chunk in chunks])
+        await interaction.followup.send(content=response)
+        return response
+    except BaseException:
+        sessions.invalidate(interaction.user.name)
+        raise
+
+
+# Every command receives its own UnitOfWork as db: reads go to Firestore, writes are staged by Player and
+# Dungeon and sent in a single batch by the commit at the end of the handler. Player and Dungeon come from
+# the session cache, so a command that follows shortly after another usually needs no reads at all.
+
 async def start(interaction, db):
     try:
-        await interaction.response.defer()
-        player = await Player.load_from_db(interaction.user.name, db)
+        player = await sessions.player(interaction.user.name, db)
         if not player:
             player = Player(interaction.user.name, db)
 
-        dungeon = Dungeon.load_dungeon(player, db)
+        dungeon = await sessions.dungeon(player, db)
         if dungeon is None:
             dungeon = Dungeon(player, db)
-            dungeon.save_dungeon(db)
+            sessions.set_dungeon(player.name, dungeon)
 
         player.dungeon = dungeon  
-        response = dungeon.start(db)
+        # Generation runs on the llm pool so other commands are still answered while it is in flight
+        await play(interaction, dungeon.stream_start, db)
         player.save_to_db(db)
         dungeon.save_dungeon(db)  # Added the db argument
-        await interaction.followup.send(content=response)
+        await db.commit()
+        # Start on the first room while the player reads the introduction
+        dungeon.prefetch_next_room()
     
+    except InteractionExpired as e:
+        print(f"Interaction expired: {e} {llm_pool.metrics()} {batching_metrics()}")
     except FileNotFoundError as e:
         print(f"File not found error: {e}")
     except KeyError as e:
@@ -70,25 +105,27 @@ async def start(interaction, db):
 
 async def continue_command(interaction, db):
     try:
-        await interaction.response.defer()
-        player = await Player.load_from_db(interaction.user.name, db)
+        player = await sessions.player(interaction.user.name, db)
         if not player:
             error_message = "Player not found. Please start a new game."
             await interaction.followup.send(content=error_message)
             return
 
-        dungeon = Dungeon.load_dungeon(player, db)
+        dungeon = await sessions.dungeon(player, db)
         if not dungeon:
             error_message = "Dungeon not found. Please start a new game."
             await interaction.followup.send(content=error_message)
             return
 
         player.dungeon = dungeon  
-        response = dungeon.continue_adventure(db)
+        # stream_adventure saves the dungeon itself once the room is played
+        await play(interaction, dungeon.stream_adventure, db)
         player.save_to_db(db)
-        dungeon.save_dungeon(db)
-        await interaction.followup.send(content=response)
+        await db.commit()
+        dungeon.prefetch_next_room()
     
+    except InteractionExpired as e:
+        print(f"Interaction expired: {e} {llm_pool.metrics()} {batching_metrics()}")
     except FileNotFoundError as e:
         print(f"File not found error: {e}")
     except KeyError as e:
@@ -106,32 +143,23 @@ async def continue_command(interaction, db):
 
 
 async def inventory(interaction, db):
-    await interaction.response.defer()
-    player = await Player.load_from_db(interaction.user.name, db)
+    player = await sessions.peek_player(interaction.user.name, db)
     if not player:
         error_message = "Player not found. Please start a new game."
         await interaction.followup.send(content=error_message)
         return
 
-    embed = discord.Embed(title="Your Inventory", color=0x00ff00)
-            
-    if not player.inventory and not player.items:
-        embed.description = "Your inventory is empty."
+    # Pages are rendered on demand and reused until the inventory changes
+    pages = inventory_pages.get(player)
+    if pages.page_count > 1:
+        await interaction.followup.send(embed=pages.page(0), view=InventoryView(player))
     else:
-        if player.inventory:
-            # add the treasures to the embed, add an integer field starting at 1 for each treasure
-            embed.add_field(name="Treasures", value="\n".join([f"{idx+1}. {treasure}" for idx, treasure in enumerate(player.inventory)]), inline=False)
-        if player.items:
-            # add the items to the embed, add an integer field starting at 1 for each item
-            embed.add_field(name="Items", value="\n".join([f"{idx+1}. {item}" for idx, item in enumerate(player.items)]), inline=False)
-
-    await interaction.followup.send(embed=embed)
+        await interaction.followup.send(embed=pages.page(0))
 
 async def equip(interaction, db):
     """ equip command """
     try:
-        await interaction.response.defer()
-        player = await Player.load_from_db(interaction.user.name, db)
+        player = await sessions.player(interaction.user.name, db)
         if not player:
             error_message = "Player not found. Please start a new game."
             await interaction.followup.send(content=error_message)
@@ -146,6 +174,7 @@ async def equip(interaction, db):
 
         equip_response = player.equip_armor(inventory_index)
         player.save_to_db(db)
+        await db.commit()
         await interaction.followup.send(content=equip_response)
     except Exception as e:  # Catching exceptions generically should be the last resort
         print(f"An error occurred: {e}")
@@ -156,23 +185,22 @@ async def equip(interaction, db):
 
 async def flee(interaction, db):
     try:
-        await interaction.response.defer()
-        player = await Player.load_from_db(interaction.user.name, db)
+        player = await sessions.player(interaction.user.name, db)
         if not player:
             error_message = "Player not found. Please start a new game."
             await interaction.followup.send(content=error_message)
             return
 
-        dungeon = Dungeon.load_dungeon(player, db)
+        dungeon = await sessions.dungeon(player, db)
         if not dungeon:
             error_message = "Dungeon not found. Please start a new game."
             await interaction.followup.send(content=error_message)
             return
 
         player.dungeon = dungeon  
-        fleeing_response = player.flee(db)
+        fleeing_response = player.flee(db)  # flee also deletes the dungeon
         player.save_to_db(db)
-        dungeon.delete_dungeon(db)
+        await db.commit()
         await interaction.followup.send(content=fleeing_response)
         
     except Exception as e: 
@@ -184,14 +212,13 @@ async def flee(interaction, db):
 
 async def escape(interaction, db):
     try:
-        await interaction.response.defer()
-        player = await Player.load_from_db(interaction.user.name, db)
+        player = await sessions.player(interaction.user.name, db)
         if not player:
             error_message = "Player not found. Please start a new game."
             await interaction.followup.send(content=error_message)
             return
 
-        dungeon = Dungeon.load_dungeon(player, db)
+        dungeon = await sessions.dungeon(player, db)
         if not dungeon:
             error_message = "Dungeon not found. Please start a new game."
             await interaction.followup.send(content=error_message)
@@ -205,9 +232,9 @@ async def escape(interaction, db):
 
         player.dungeon = dungeon
         escaping_response = player.escape(db)
-        player.save_to_db(db)
         player.restore_health(db)
         dungeon.delete_dungeon(db)
+        await db.commit()
         await interaction.followup.send(content=escaping_response)
             
     except Exception as e: 
@@ -217,46 +244,55 @@ async def escape(interaction, db):
         traceback.print_exc()
         await interaction.followup.send(content=error_message)
 
+async def trade(interaction, db, action):
+    """
+    Run action(player, db) on the user's Player and commit its writes in a transaction guarded by the
+    economy fields the player was loaded with. If another instance changed them in the meantime, the player
+    is reloaded and the action applied once more. The same happens when the action turns the request down
+    with a ValueError, since the cached copy it checked may be out of date. If the action staged no writes,
+    no transaction is opened.
+    """
+    for attempt in range(2):
+        player = await sessions.player(interaction.user.name, db)
+        expected = player.economy_snapshot()
+        try:
+            response = action(player, db)
+        except ValueError as e:
+            if attempt:
+                raise
+            print(f"Rechecking a refused trade for {player.name} against Firestore: {e}")
+            db.discard()
+            sessions.invalidate(player.name)
+            continue
+        if not db.pending_writes:
+            return response
+        try:
+            await db.commit_guarded(db.collection('players').document(player.name).ref, expected)
+            return response
+        except StaleWrite as e:
+            print(f"Stale economy write for {player.name}: {e}")
+            db.discard()
+            sessions.invalidate(player.name)
+    raise StaleWrite("Your inventory kept changing during the transaction.")
+
+
 async def sell(interaction, item_index, db):
     try:
         item_index -= 1  # Adjust for 0-based indexing
-        await interaction.response.defer()
                 
         print(f"Debug: Item index: {item_index}")
                 
-        player = await Player.load_from_db(interaction.user.name, db)
-                
-        if not player:
-            error_message = "Player not found. Please start a new game."
-            await interaction.followup.send(content=error_message)
-            return
+        def sell_treasure(player, db):
+            if item_index < 0 or item_index >= len(player.inventory):
+                raise ValueError("Invalid item index. Please try again.")
+            # The player's packed inventory is the only copy of their treasures
+            return player.sell_item(item_index, db)
 
-        # Retrieve player's inventory from Firestore
-        player_ref = db.collection('players').document(player.name)
-        player_data = player_ref.get()
-        if player_data.exists:
-            player_data = player_data.to_dict()
-            inventory = player_data.get('inventory', [])
-            if item_index < 0 or item_index >= len(inventory):
-                error_message = "Invalid item index. Please try again."
-                await interaction.followup.send(content=error_message)
-                return
-            target_treasure_doc = inventory[item_index]
-
-            target_treasure = Treasure.from_dict(target_treasure_doc)
-                    
-            # Add the item's value to player's doubloons
-            player.doubloons += target_treasure.value
-
-            #remove target treasure from player in Firestore
-            inventory.pop(item_index)
-            player_ref.update({"inventory": inventory, "doubloons": player.doubloons})
-
-            sale_response = f"Sold {target_treasure.treasure_type} for {target_treasure.value} doubloons."
-                
-            # The sell operation is done, now save the player's updated state to the Firestore
-            await interaction.followup.send(content=sale_response)
-            
+        sale_response = await trade(interaction, db, sell_treasure)
+        await interaction.followup.send(content=sale_response)
+
+    except ValueError as e:
+        await interaction.followup.send(content=str(e))
     except Exception as e:
         print(f"Debug: An error occurred while selling items: {e}")
         error_message = "An error occurred during the transaction. Please try again."
@@ -264,31 +300,33 @@ async def sell(interaction, item_index, db):
         await interaction.followup.send(content=error_message)
 
 async def shop(interaction, db):
-    await interaction.response.defer()
-    shop = Shop()
+    shop = shop_catalog.current()
     shop_display = shop.get_shop_display()
     await interaction.followup.send(content=shop_display)
 
-async def buy(interaction, item_index, db):
+async def buy(interaction, item_index, quantity, db):
     try:
         item_index -= 1  # Adjust for 0-based indexing
-        await interaction.response.defer()
 
         print(f"Debug: Item index: {item_index}")
 
-        player = await Player.load_from_db(interaction.user.name, db)  # Loading the player from the database
+        player = await sessions.player(interaction.user.name, db)  # Loading the player from the database
 
         if not player:
             error_message = "Player not found. Please start a new game."
             await interaction.followup.send(content=error_message)
             return
 
-        # Initialise the Shop and buy the selected item
-        shop = Shop()
+        # Buy the selected item from the current catalog
+        shop = shop_catalog.current()
             
         try:
-            item_name = shop.buy(item_index, player, db)
-            await interaction.followup.send(content=f"You bought the {item_name}!")
+            # Doubloons and items are committed in a transaction, see trade()
+            item_name = await trade(interaction, db, lambda player, db: shop.buy(item_index, player, db, quantity))
+            if quantity > 1:
+                await interaction.followup.send(content=f"You bought {quantity} x {item_name}!")
+            else:
+                await interaction.followup.send(content=f"You bought the {item_name}!")
         except Exception as e:
             print(f"An error occurred while purchasing item: {e}")
             error_message = str(e)
@@ -301,8 +339,7 @@ async def buy(interaction, item_index, db):
         await interaction.followup.send(content=error_message)
 
 async def stats(interaction, db):
-    await interaction.response.defer()
-    player = await Player.load_from_db(interaction.user.name, db)
+    player = await sessions.peek_player(interaction.user.name, db)
     if not player:
         error_message = "Player not found. Please start a new game."
         await interaction.followup.send(content=error_message)
@@ -315,15 +352,14 @@ async def stats(interaction, db):
 
 async def use(interaction, item_index, db):
     try:
-        await interaction.response.defer()
-        player = await Player.load_from_db(interaction.user.name, db)
+        player = await sessions.player(interaction.user.name, db)
         if not player:
             error_message = "Player not found. Please start a new game."
             await interaction.followup.send(content=error_message)
             return
 
         use_item_response = player.use_item(item_index-1, db)  # items in inventory start from 1
-        player.save_to_db(db)
+        await db.commit()
         await interaction.followup.send(content=use_item_response)
             
     except Exception as e:  # Catching exceptions generically should be the last resort
@@ -334,51 +370,72 @@ async def use(interaction, item_index, db):
 def main():
     intents = discord.Intents.default()
     bot = DungeonBot(intents=intents)
-    db = firestore.client()
+    db = firestore_async.client()
+
+    async def run_command(handler, interaction, *args):
+        # Acknowledge right away, since the command may have to wait for the user's previous one to finish
+        await interaction.response.defer()
+        async with command_queue.turn(interaction.user.name):
+            # The entry stays cached until this command is done, so the objects it commits are the ones
+            # the user's next command gets
+            with sessions.pinned(interaction.user.name):
+                session = UnitOfWork(db)
+                try:
+                    await handler(interaction, *args, db=session)
+                finally:
+                    if session.pending_writes:
+                        # The cached objects were changed but the writes never reached Firestore
+                        sessions.invalidate(interaction.user.name)
+
+    async def run_query(handler, interaction):
+        # Read-only commands only look at the Player, so they answer right away instead of waiting behind
+        # the user's /continue. They never add to the session cache (see SessionCache.peek_player).
+        await interaction.response.defer()
+        await handler(interaction, db=UnitOfWork(db))
 
     @bot.tree.command(name="start")
     async def start_cmd(interaction):
-        await start(interaction, db=db)
+        await run_command(start, interaction)
 
     @bot.tree.command(name="continue")
     async def continue_cmd(interaction):
-        await continue_command(interaction, db=db)
+        await run_command(continue_command, interaction)
 
     @bot.tree.command(name="inventory")
     async def inventory_cmd(interaction):
-        await inventory(interaction, db=db)
+        await run_query(inventory, interaction)
 
     @bot.tree.command(name="equip")
     async def equip_cmd(interaction):
-        await equip(interaction, db=db)
+        await run_command(equip, interaction)
 
     @bot.tree.command(name="flee")
     async def flee_cmd(interaction):
-        await flee(interaction, db=db)
+        await run_command(flee, interaction)
     
     @bot.tree.command(name="escape")
     async def escape_cmd(interaction):
-        await escape(interaction, db=db)
+        await run_command(escape, interaction)
 
     @bot.tree.command(name="sell")
     async def sell_cmd(interaction, item_index: int):
-        await sell(interaction, item_index, db=db)
+        await run_command(sell, interaction, item_index)
     
     @bot.tree.command(name="shop")
     async def shop_cmd(interaction):
-        await shop(interaction, db=db)
+        await run_query(shop, interaction)
 
     @bot.tree.command(name="buy")
-    async def buy_cmd(interaction, item_index: int):
-        await buy(interaction, item_index, db=db)
+    async def buy_cmd(interaction, item_index: int, quantity: int = 1):
+        await run_command(buy, interaction, item_index, quantity)
     
     @bot.tree.command(name="stats")
     async def stats_cmd(interaction):
-        await stats(interaction, db=db)
+        await run_query(stats, interaction)
 
     @bot.tree.command(name="use")
     async def use_cmd(interaction, item_index: int):
-        await use(interaction, item_index, db=db)
+        await run_command(use, interaction, item_index)
 
     bot.run(TOKEN)
 
@@ -0,0 +1,55 @@
+import random
+
+# Fights are computed here without side effects; Player.handle_combat applies the outcome.
+
+
+class CombatOutcome:
+    def __init__(self, enemy_threat_level, rounds, final_health, won, experience):
+        self.enemy_threat_level = enemy_threat_level
+        self.rounds = rounds  # (player attack, enemy attack, damage taken or None if the enemy fell, health after)
+        self.final_health = final_health
+        self.won = won
+        self.died = not won
+        self.experience = experience
+
+    @property
+    def damage_dealt(self):
+        return sum(player_attack for player_attack, _, _, _ in self.rounds)
+
+    @property
+    def damage_taken(self):
+        return sum(taken for _, _, taken, _ in self.rounds if taken is not None)
+
+    def render(self):
+        lines = []
+        for player_attack, enemy_attack, taken, health in self.rounds:
+            if taken is not None:
+                lines.append(f"You took {taken} damage and have {health} health remaining.")
+            lines.append(f"Player dealt {player_attack} damage to the enemy.")
+            lines.append(f"Enemy dealt {enemy_attack} damage to the player.")
+            lines.append("---")
+        return "\n".join(lines) + "\n"
+
+
+def resolve_combat(health, max_base_damage, enemy_threat_level, armor_defense=0, rng=random):
+    """
+    Fight an enemy of the given threat level without touching the player or the database.
+    Each round the player strikes first; the enemy strikes back while it still stands, reduced by armor.
+    """
+    enemy_health = enemy_threat_level
+    # Threat levels grow by a fractional multiplier, while attack rolls need an integer bound
+    enemy_max_attack = int(enemy_threat_level)
+    rounds = []
+    while health > 0 and enemy_health > 0:
+        player_attack = rng.randint(0, max_base_damage)
+        enemy_attack = rng.randint(0, enemy_max_attack)
+        enemy_health -= player_attack
+        taken = None
+        if enemy_health > 0:
+            taken = max(enemy_attack - armor_defense, 0)
+            health = max(health - taken, 0)
+        rounds.append((player_attack, enemy_attack, taken, health))
+
+    won = health > 0
+    experience = round(enemy_threat_level) if won else 0
+    return CombatOutcome(enemy_threat_level, rounds, health, won, experience)
@@ -1,14 +1,20 @@
-from langchain import HuggingFaceHub, LLMChain
-from langchain.memory import ConversationBufferMemory, ChatMessageHistory
-from langchain.prompts import PromptTemplate
+from langchain.memory import ChatMessageHistory
 
-from firebase_admin import firestore
-from treasure import Treasure
+from adventure_memory import AdventureMemory
+from llm import CHAINS, get_provider, narration_executor
+from fallback import NARRATIVE_BUDGET_SECONDS, NARRATIVE_STALL_SECONDS, render_fallback
+from narrative_cache import narrative_cache
+from prefetch import PrefetchedRoom, prefetch_slots
+from session import UnitOfWork, write_changes
+import rng
 
+import queue
 import random
+import time
 
 # The firestore client should be initialized in the bot.py file. The Dungeon class uses the instance previously created.
 # You don't need to initialize it again here. Please remove: db = firestore.client()
+# Within a command, db is the command's UnitOfWork: writes are staged and committed together at the end.
 
 class Dungeon:
     def __init__(self, player, db):
@@ -23,283 +29,294 @@ class Dungeon:
         self.escape_chance = 0.1
         self.room_type = "start"
         self.chat_history = ChatMessageHistory()
-        self.memory = ConversationBufferMemory(memory_key="adventure_history")
+        self.memory = AdventureMemory(memory_key="adventure_history")
+        self.deleted = False
+        self.latency_budget = NARRATIVE_BUDGET_SECONDS
+        self.deadline = None
+        self.seed = rng.new_seed()  # every roll in this run comes from streams derived from the seed
+        self._persisted = None  # the dungeon document as last read or written, None if it doesn't exist yet
+        self.update_time = None  # when the dungeon document was last changed, as of that read or write
 
     def delete_dungeon(self, db):
         print("delete_dungeon")
         # Get a reference to the Dungeon document and then call the delete() method.
         dungeon_ref = db.collection('dungeons').document(self.player.name)
         dungeon_ref.delete()
+        # Whatever was prefetched belonged to this run
+        self.deleted = True
+        prefetch_slots.invalidate(self.player.name)
 
 
-    def start(self, db):
+    def submit_narrative(self, chain_name, **inputs):
+        """
+        Start generating a narrative and return its future. Served from the narrative cache once the
+        combination of chain, inputs and temperature has enough variants.
+        """
         random_temperature = random.uniform(0.5, 0.7)
+        provider = get_provider(self.repo_id_llm)
+        chain = CHAINS[chain_name]
+        return narrative_cache.submit(chain_name, inputs, random_temperature,
+                                      lambda: chain.submit(provider, self.memory, random_temperature, **inputs))
 
-        dungeon_llm = HuggingFaceHub(repo_id=self.repo_id_llm,
-                                    model_kwargs={
-                                        "temperature": random_temperature,
-                                        "max_new_tokens": 250
-                                    })
-
-        prompt_template = "{adventure_history} Paint a vivid picture of a {adventure_type} adventure set in an ancient and mysterious dungeon. What atmosphere and characteristics define this dungeon?"
-        dungeon_start_prompt = PromptTemplate(template=prompt_template,
-                                                input_variables=["adventure_history", "adventure_type"])
+    def begin_command(self):
+        """
+        Start the latency budget for the command being played. Narratives that miss it are replaced by templates.
+        """
+        self.deadline = time.monotonic() + self.latency_budget
 
-        llm_chain = LLMChain(prompt=dungeon_start_prompt, llm=dungeon_llm, memory=self.memory)
+    def remaining_budget(self):
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
 
+    def wait_narrative(self, future, chain_name, inputs, attributes=None):
+        """
+        Wait for a narrative within the latency budget and record it in the adventure memory.
+        If generation fails or misses the deadline the room is rendered from a template instead;
+        a late result still reaches the narrative cache for later rooms.
+        """
         try:
-            response = llm_chain.predict(adventure_type="dungeoneering")
-            response += "\nDo you /continue or /flee?"
+            output = future.result(timeout=self.remaining_budget())
         except Exception as e:
-            response = f"I couldn't generate a response due to the following error: {str(e)}"
+            print(f"Using a template for the {chain_name} narrative: {e!r}")
+            output = render_fallback(chain_name, inputs, attributes)
+        CHAINS[chain_name].remember(self.memory, inputs, output)
+        return output
+
+    def stream_narrative(self, chain_name, attributes=None, **inputs):
+        """
+        Yield a narrative chunk by chunk as the model produces it, then record it in the adventure memory.
+        A cached variant is yielded in one piece. If nothing has arrived by the deadline the room is rendered
+        from a template. Once text is flowing the deadline no longer applies; the text is only cut short if
+        the stream fails or goes quiet for longer than NARRATIVE_STALL_SECONDS.
+        """
+        random_temperature = random.uniform(0.5, 0.7)
+        chain = CHAINS[chain_name]
+        key = narrative_cache.make_key(chain_name, inputs, random_temperature)
+        output = narrative_cache.get(key)
+        if output is not None:
+            yield output
+            chain.remember(self.memory, inputs, output)
+            return
+
+        tokens = chain.stream(get_provider(self.repo_id_llm), self.memory, random_temperature, **inputs)
+        chunks = queue.Queue()
+
+        def produce():
+            parts = []
+            try:
+                for chunk in tokens:
+                    parts.append(chunk)
+                    chunks.put(chunk)
+            except Exception as e:
+                chunks.put(e)
+                return
+            chunks.put(None)
+            # Stored even when the room stopped waiting for it
+            narrative_cache.add(key, "".join(parts))
+
+        narration_executor.submit(produce)
+        shown = []
+        while True:
+            try:
+                chunk = chunks.get(timeout=NARRATIVE_STALL_SECONDS if shown else self.remaining_budget())
+            except queue.Empty:
+                if shown:
+                    chunk = TimeoutError("the narrative stalled")
+                else:
+                    chunk = TimeoutError("the narrative missed its latency budget")
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                print(f"Stopped streaming the {chain_name} narrative: {chunk!r}")
+                if shown:
+                    shown.append("...")
+                    yield "..."
+                else:
+                    shown.append(render_fallback(chain_name, inputs, attributes))
+                    yield shown[-1]
+                break
+            shown.append(chunk)
+            yield chunk
+        chain.remember(self.memory, inputs, "".join(shown))
+
+    def start(self, db):
+        return "".join(self.stream_start(db))
 
-        return response
+    def stream_start(self, db):
+        self.begin_command()
+        try:
+            yield from self.stream_narrative("start", adventure_type="dungeoneering")
+            yield "\nDo you /continue or /flee?"
+        except Exception as e:
+            yield f"I couldn't generate a response due to the following error: {str(e)}"
 
     def continue_adventure(self, db):
-        # use db ref to update depth 
+        return "".join(self.stream_adventure(db))
+
+    def stream_adventure(self, db):
+        """
+        Play the next room, yielding its text as it is generated.
+        The dungeon is only updated once the generator has been run to the end.
+        """
+        self.begin_command()
+        # The new depth is written with the rest of the dungeon by save_dungeon
         self.depth += 1
-        doc_ref = db.collection('dungeons').document(self.player.name)
-        doc_ref.update({'depth': self.depth})
 
-        damage_taken = 0
-        response = ""
         print(self.player.name +' is continuing the dungeon adventure at depth ' + str(self.depth))
 
         self.print_threat_level()
 
-        weights = {
-            "combat": self.threat_level,
-            "treasure": max(1, 10 - self.threat_level),
-            "nothing": max(1, 5 - self.threat_level),
-            "escape":max(1, 10 - self.threat_level)
-        }
-
-        encounter = random.choices(
-            population=["combat", "treasure", "nothing", "escape"], 
-            weights=[weights["combat"], weights["treasure"], weights["nothing"], weights["escape"]],
-            k=1
-        )[0]
+        # Use the room prefetched while the player was reading the last one, if there is one for this depth
+        room = prefetch_slots.take(self.player.name, self.depth, self.threat_level)
+        if room is not None:
+            encounter = room.encounter
+        else:
+            encounter = self.roll_encounter(self.depth)
         self.room_type = encounter
 
         if (encounter == "combat"):
             print('encountered a combat encounter: ', self.player.name)
-            response += self.combat_operation(db)
+            yield from self.combat_operation(db, room)
 
         if encounter == "treasure":
             print('encountered a treasure room: ', self.player.name)
-            response += self.treasure_operation(db)
+            yield from self.treasure_operation(db, room)
 
         if (encounter == "nothing"):
             print('encountered an empty room: ', self.player.name)
-            response += self.no_encounter_operation(db)
+            yield from self.no_encounter_operation(db, room)
         if encounter == "escape":
             print('encountered an escape room: ', self.player.name)
-            response += self.escape_room_operation(db)        
+            yield from self.escape_room_operation(db, room)
 
         self.update_threat_level(db)
         self.save_dungeon(db)
-        return response
 
-    def print_threat_level(self):
-        print(f"Threat Level: {self.threat_level}")
-        response = f"\nThreat Level: {self.threat_level}"
+    def room_stream(self, depth, purpose):
+        return rng.room_stream(self.seed, depth, purpose)
 
-    # Implement the remaining needed methods as per the task and recorrecting where needed
-    def escape_room_operation(self, db):
-        # Generate random temperature variable for the language model chain
-        random_temperature = random.uniform(0.5, 0.7)
+    def roll_encounter(self, depth):
+        return rng.roll_encounter(self.room_stream(depth, "encounter"), self.threat_level)
 
-        dungeon_llm = HuggingFaceHub(repo_id=self.repo_id_llm,
-                                    model_kwargs={
-                                        "temperature": random_temperature,
-                                        "max_new_tokens": 100
-                                    })
+    def roll_enemy(self, depth):
+        return rng.roll_enemy(self.seed, depth)
 
-        generate_escape_room_prompt = "{adventure_history} Amidst the labyrinthine passages, the adventurer discovers a concealed door adorned with {properties}. This is no ordinary room—it's an escape chamber. Elaborate on its enigmatic features."
-        llm_escape_room_prompt = PromptTemplate(template=generate_escape_room_prompt,
-                                                input_variables=["adventure_history", "properties"])
+    def roll_treasure(self, depth):
+        return rng.roll_treasure(self.seed, depth)
 
-        print("generating escape room")
-        escape_room_chain = LLMChain(prompt=llm_escape_room_prompt, llm=dungeon_llm, memory=self.memory)
-        escape_room_description = escape_room_chain.predict(properties="bathed in white light")
+    def plan_room(self, encounter, depth):
+        return rng.plan_room(self.seed, encounter, depth)
 
-        response = "\nESCAPE ROOM\n"
-        response += escape_room_description
-        response += "\nDo you /continue or /escape?"
+    def prefetch_next_room(self):
+        """
+        Pick the next room now and start generating its opening narrative in the background.
+        Called right after a response has been sent, while the player is still reading it.
+        """
+        if self.deleted:
+            return
+        depth = self.depth + 1
+        encounter = self.roll_encounter(depth)
+        details, chain_name, inputs = self.plan_room(encounter, depth)
+        future = self.submit_narrative(chain_name, **inputs)
+        room = PrefetchedRoom(depth, self.threat_level, encounter, details, chain_name, inputs, future)
+        prefetch_slots.put(self.player.name, room)
+
+    def collect_prefetched(self, room):
+        """
+        Wait for a prefetched narrative within the latency budget and record it in the adventure memory.
+        """
+        return self.wait_narrative(room.future, room.chain_name, room.inputs, room.details.get("enemy"))
 
-         # Player flees the dungeon without losing any treasure
-        return response
+    def print_threat_level(self):
+        print(f"Threat Level: {self.threat_level}")
+        response = f"\nThreat Level: {self.threat_level}"
 
-    def combat_operation(self, db):
-        # Generate random temperature variable for the language model chain
-        random_temperature = random.uniform(0.5, 0.7)
+    # Each room operation is a generator yielding the room's text as it is produced
+    def escape_room_operation(self, db, room=None):
+        print("generating escape room")
+        yield "\nESCAPE ROOM\n"
+        if room is not None:
+            yield self.collect_prefetched(room)
+        else:
+            yield from self.stream_narrative("escape", properties="bathed in white light")
+        yield "\nDo you /continue or /escape?"
 
-        dungeon_llm = HuggingFaceHub(repo_id=self.repo_id_llm,
-                                    model_kwargs={
-                                        "temperature": random_temperature,
-                                        "max_new_tokens": 100
-                                    })
-        
-        enemy_attributes = {
-            "type": random.choice(["goblin", "troll", "dragon", "skeleton", "zombie"]),
-            "weapon": random.choice(["claws", "sword", "magic", "fangs", "axe"]),
-            "appearance": random.choice(["horrifying", "grotesque", "terrifying", "ghastly", "hideous"]),
-            "strength": random.choice(["immense strength", "magical powers", "swift agility", "overwhelming numbers", "deadly precision"]),
-            "weakness": random.choice(["fear of light", "slow movements", "limited vision", "low intelligence", "magic susceptibility"])
-        }
+         # Player flees the dungeon without losing any treasure
 
-        enemy_assembled_string = f'A {enemy_attributes["appearance"]} {enemy_attributes["type"]} wielding a {enemy_attributes["weapon"]} with {enemy_attributes["strength"]}, but has a {enemy_attributes["weakness"]}'
+    def combat_operation(self, db, room=None):
+        if room is not None:
+            enemy_attributes = room.details["enemy"]
+        else:
+            enemy_attributes = self.roll_enemy(self.depth)
+        enemy_assembled_string = rng.describe_enemy(enemy_attributes)
         print("Enemy string: " + enemy_assembled_string)
-        generate_enemy_prompt = "{adventure_history} Deep within the dungeon, where distant cries and howls reverberate, the adventurer faces an impending menace. Emerging from the gloom is a {enemy}. Detail its fearsome aspects."
-        llm_enemy_prompt = PromptTemplate(template=generate_enemy_prompt, input_variables=["adventure_history", "enemy"])
-
-        print("generating enemy")
-        enemy_chain = LLMChain(prompt=llm_enemy_prompt, llm=dungeon_llm, memory=self.memory)
-        enemy_description = enemy_chain.predict(enemy=enemy_assembled_string)
-
-        combat_status, combat_message = self.player.handle_combat(self.threat_level, db)
-
-        print("generating narrative")
-        print("enemy description: " + enemy_description)
-        if combat_status == "won":
-            combat_narrative = self.get_victory_narrative(enemy_assembled_string)
-        else:  # if the combat_status is "lost"
-            combat_narrative = self.get_defeat_narrative(enemy_assembled_string)
-
-        response = f"\nCOMBAT ENCOUNTER\n"
-        response += f"Enemy: {enemy_assembled_string}\n"
-
-        response += enemy_description
-        response += combat_narrative
-        response += "\n"+combat_message
-
-        return response
-
-    def get_victory_narrative(self, enemy_description):
-        print("get_victory_narrative")
-        random_temperature = random.uniform(0.5, 0.7)  # You can adjust the temperature as needed
-
-        dungeon_llm = HuggingFaceHub(repo_id=self.repo_id_llm,
-                                        model_kwargs={
-                                            "temperature": random_temperature,
-                                            "max_new_tokens": 100
-                                        })
-
-        victory_prompt = "{adventure_history} Armed with courage and unparalleled skill, the hero confronts the {enemy_description}. Narrate the awe-inspiring moment when the hero triumphs over the creature."
-        llm_victory_prompt = PromptTemplate(template=victory_prompt, input_variables=["adventure_history", "enemy_description"])
-
-        victory_chain = LLMChain(prompt=llm_victory_prompt, llm=dungeon_llm, memory=self.memory)
-        combat_narrative = victory_chain.predict(enemy_description=enemy_description.format())
-    
-        return combat_narrative
-
-    def get_defeat_narrative(self, enemy_description):
-        print("get_defeat_narrative")
-        random_temperature = random.uniform(0.5, 0.7)  # You can adjust the temperature as needed
-
-        dungeon_llm = HuggingFaceHub(repo_id=self.repo_id_llm,
-                                        model_kwargs={
-                                            "temperature": random_temperature,
-                                            "max_new_tokens": 100
-                                        })
-        
-        defeat_prompt = "{adventure_history} Despite the hero's valiant efforts, the {enemy_description} proves to be too powerful. Describe the tragic moment the hero is defeated by the beast."
-        llm_defeat_prompt = PromptTemplate(template=defeat_prompt, input_variables=["adventure_history", "enemy_description"])
-
-        defeat_chain = LLMChain(prompt=llm_defeat_prompt, llm=dungeon_llm, memory=self.memory)
-        combat_narrative = defeat_chain.predict(enemy_description=enemy_description.format())
-    
-        return combat_narrative
+        # The fight does not depend on the enemy description, so resolve it first and let the
+        # outcome narrative generate in the background while the enemy description streams.
+        combat, aftermath = self.player.handle_combat(
+            self.threat_level, db, rng=self.room_stream(self.depth, "combat"))
+        outcome_chain = "victory" if combat.won else "defeat"
+        outcome_inputs = {"enemy_description": enemy_assembled_string}
+        outcome = self.submit_narrative(outcome_chain, **outcome_inputs)
+
+        yield "\nCOMBAT ENCOUNTER\n"
+        yield f"Enemy: {enemy_assembled_string}\n"
+
+        print("generating enemy and combat narrative")
+        if room is not None:
+            yield self.collect_prefetched(room)
+        else:
+            yield from self.stream_narrative("enemy", attributes=enemy_attributes, enemy=enemy_assembled_string)
 
+        combat_narrative = self.wait_narrative(outcome, outcome_chain, outcome_inputs, enemy_attributes)
+        yield combat_narrative
+        yield "\n" + combat.render() + aftermath
 
-    def treasure_operation(self, db):
+    def treasure_operation(self, db, room=None):
         """
         Handles the operation where the adventure enters a treasure room.
         """
-        random_temperature = random.uniform(0.5, 0.7)
-
-        dungeon_llm = HuggingFaceHub(
-            repo_id=self.repo_id_llm,
-            model_kwargs={
-                "temperature": random_temperature,
-                "max_new_tokens": 150
-            }
-        )
-
-        treasure_type = random.choice(["jewel", "artifact", "scroll", "potion", "grimoire"])
-        material = random.choice(["gold", "silver", "diamond", "ruby"])
-        origin = random.choice(["dwarven", "elvish", "dragon hoard"])
-            
-        # Create a Treasure object
-        discovered_treasure = Treasure(treasure_type, material, origin)
+        if room is not None:
+            discovered_treasure = room.details["treasure"]
+        else:
+            discovered_treasure = self.roll_treasure(self.depth)
             
         # Add the treasure to the player's inventory
         self.player.add_to_inventory(discovered_treasure, db)
-            
-        # Add the treasure discovery to the scene description
-        response = f"\nYou discovered a {discovered_treasure}!"
-
-        
-        generate_treasure_prompt = "{adventure_history} In the depths of the ancient and mystical dungeon, amidst the eerie silence punctuated by the echoes of distant roars and clanks, a hidden chamber reveals itself. Shrouded in mystery, it harbors a {treasure}."  # Changed {treasure_assembled_string} to {treasure}
-        llm_treasure_prompt = PromptTemplate(template=generate_treasure_prompt,
-                                            input_variables=["adventure_history", "treasure"])  # Changed "treasure_assembled_string" to "treasure"
-
-        # Create language model chain and run against our prompt
-        treasure_chain = LLMChain(prompt=llm_treasure_prompt, llm=dungeon_llm, memory=self.memory)
-        generated_treasure = treasure_chain.predict(treasure=str(discovered_treasure))  # Changed {treasure_assembled_string={treasure_assembled_string}} to treasure=treasure_assembled_string
-
-        # Add the treasure to the player's inventory and database
-        #self.add_treasure_to_db(discovered_treasure, db)
-
-        response = "\nTREASURE ROOM\n"
-        response += f"\nYou discovered a {discovered_treasure}!"
-        response += generated_treasure
 
-        return response
+        yield "\nTREASURE ROOM\n"
+        yield f"\nYou discovered a {discovered_treasure}!"
+        if room is not None:
+            yield self.collect_prefetched(room)
+        else:
+            yield from self.stream_narrative("treasure", treasure=str(discovered_treasure))
 
-    def no_encounter_operation(self, db):
+    def no_encounter_operation(self, db, room=None):
         """
         Handles the operation where the adventure enters an empty room.
         """
-        random_temperature = random.uniform(0.5, 0.7)
-
-        dungeon_llm = HuggingFaceHub(repo_id=self.repo_id_llm,
-                                    model_kwargs={
-                                        "temperature": random_temperature,
-                                        "max_new_tokens": 250
-                                    })
-
-        continue_dungeon_prompt = "{adventure_history} Describe an {quality} room in detail."
-        llm_prompt = PromptTemplate(template=continue_dungeon_prompt, input_variables=["adventure_history", "quality"])
-
-        llm_chain = LLMChain(prompt=llm_prompt, llm=dungeon_llm, memory=self.memory)
-
+        yield "\nEMPTY ROOM\n"
         try:
-            generated_description = llm_chain.run(quality="empty")
+            if room is not None:
+                generated_description = self.collect_prefetched(room)
+                yield generated_description
+            else:
+                generated_description = ""
+                for chunk in self.stream_narrative("empty", quality="empty"):
+                    generated_description += chunk
+                    yield chunk
             self.history.append(generated_description)
 
         except Exception as e:
-            generated_description = f"I couldn't generate a description due to the following error: {str(e)}"
-
-        response = "\nEMPTY ROOM\n" + generated_description
-        return response
+            yield f"I couldn't generate a description due to the following error: {str(e)}"
     
     def add_treasure_to_db(self, treasure, db):
         """
         Add the treasure to the database.
         """
-        # Convert the Treasure object to a dictionary
-        print(type(treasure))
-        treasure_data = treasure.to_dict()
-        print(type(treasure_data))
-
-        # Here add the logic to store the treasure_data dictionary in the database
-        # This will depend on the exact database and structure you are using
-        # For example, if using Firebase Firestore:
-        # Then, store the dictionary in the Firestore database
+        # Treasures live in the packed inventory on the player document
         try:
-            # Replace this with the actual path where you want to store the treasure data
-            db.collection('players').document(self.player.name).collection('treasures').add(treasure_data)
+            self.player.add_to_inventory(treasure, db)
             return "Treasure added to the database!"
         except Exception as e:
             return f"An error occurred when adding treasure to database: {e}"    
@@ -313,14 +330,15 @@ class Dungeon:
         print("calculated threat level: " + str(self.threat_level))
         print("self.depth" + str(self.depth))
         self.threat_level = min(self.threat_level, self.max_threat_level)
-        dungeon_ref = db.collection('dungeons').document(self.player.name)
-        if dungeon_ref.get().exists:
-            dungeon_ref.update({'threat_level': self.threat_level})
 
     @staticmethod
-    def load_dungeon(player, db):
+    async def load_dungeon(player, db):
         print("load_dungeon")
-        dungeon_data = db.collection('dungeons').document(player.name).get()
+        dungeon_data = await db.collection('dungeons').document(player.name).get()
+        return Dungeon.from_snapshot(player, db, dungeon_data)
+
+    @staticmethod
+    def from_snapshot(player, db, dungeon_data):
         if dungeon_data.exists:
             data = dungeon_data.to_dict()
             d = Dungeon(player, db)
@@ -331,30 +349,39 @@ class Dungeon:
             d.room_type = data.get('room_type')
             d.max_threat_level = data.get('max_threat_level')
             d.threat_level_multiplier = data.get('threat_level_multiplier')
+            d.memory = AdventureMemory.from_dict(data.get('memory'))
+            # Dungeons saved before seeds were stored continue with a fresh one
+            d.seed = data.get('seed') or d.seed
+            d._persisted = data
+            d.update_time = dungeon_data.update_time
             
             return d
         else:
             return None
 
-    def save_dungeon(self, db: firestore.Client):
+    def save_dungeon(self, db: UnitOfWork):
         print("save_dungeon")
-        
+        if self.deleted:
+            # The run ended (death, /flee or /escape) during this command; don't write the dungeon back
+            return
+
         doc_ref = db.collection('dungeons').document(self.player.name)
-            
-        # Check if document exists
-        if doc_ref.get().exists:
-            print(f"Document for player {self.player.name} already exists.")
-            
+
         data = {
             'repo_id_llm': self.repo_id_llm,
             'depth' : self.depth,
             'threat_level' : self.threat_level,
             'room_type' : self.room_type,
             'max_threat_level' : self.max_threat_level,
-            'threat_level_multiplier' : self.threat_level_multiplier
+            'threat_level_multiplier' : self.threat_level_multiplier,
+            'memory' : self.memory.to_dict(),
+            'seed' : self.seed
         }
             
-        doc_ref.set(data)
+        # Only the fields that changed since the last read or write are sent
+        self._persisted, changed = write_changes(doc_ref, self._persisted, data, owner=self)
+        if changed:
+            print(f"Saving dungeon of {self.player.name}: {', '.join(changed)}")
 
     def to_dict(self):
         return {
@@ -0,0 +1,150 @@
+import asyncio
+import datetime
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Discord interaction tokens stay valid for 15 minutes after the interaction is created.
+# Once that passes a deferred response can no longer be followed up, so any work still queued for it is wasted.
+INTERACTION_TOKEN_LIFETIME = datetime.timedelta(minutes=15)
+
+
+class InteractionExpired(Exception):
+    """
+    Raised when blocking work could not finish before the interaction token expired.
+    """
+
+
+class WorkerPool:
+    """
+    A bounded thread pool for blocking calls (LLM generation) made from the Discord event loop.
+    At most max_concurrency calls run at once; the rest wait in line without holding a thread.
+    """
+
+    def __init__(self, name, max_workers, max_concurrency=None):
+        self.name = name
+        self.max_concurrency = max_concurrency or max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    @staticmethod
+    def _remaining(deadline):
+        if deadline is None:
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise InteractionExpired("The interaction expired before the work could start.")
+        return remaining
+
+    def _finished(self, future):
+        self.active -= 1
+        self._semaphore.release()
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self.failed += 1
+        else:
+            self.completed += 1
+
+    async def run(self, fn, *args, deadline=None, **kwargs):
+        """
+        Run fn(*args, **kwargs) on the pool and await its result.
+        If the deadline passes first, the call is abandoned and InteractionExpired is raised.
+        """
+        loop = asyncio.get_running_loop()
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self._remaining(deadline))
+        except asyncio.TimeoutError:
+            self.cancelled += 1
+            raise InteractionExpired(f"Timed out waiting for a {self.name} worker.")
+        finally:
+            self.queued -= 1
+
+        self.active += 1
+        future = loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+        # The slot is only released once the thread is really done, even if the caller gave up on it.
+        future.add_done_callback(self._finished)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self._remaining(deadline))
+        except asyncio.TimeoutError:
+            self.cancelled += 1
+            raise InteractionExpired(f"The interaction expired while waiting on a {self.name} worker.")
+
+    async def stream(self, fn, *args, deadline=None, **kwargs):
+        """
+        Run the generator function fn(*args, **kwargs) on the pool and yield its items on the event loop
+        as they are produced.
+        If the caller stops early (an error, or the deadline passing), the generator is asked to stop and
+        closing the iterator waits until the worker thread has let go of it, so whatever the generator
+        was changing is not touched behind the caller's back. Close it with contextlib.aclosing.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        finished = object()
+        stop = threading.Event()
+        started = threading.Event()
+        stopped = loop.create_future()
+
+        def pump():
+            started.set()
+            items = fn(*args, **kwargs)
+            try:
+                for item in items:
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+            finally:
+                items.close()
+                loop.call_soon_threadsafe(queue.put_nowait, finished)
+                loop.call_soon_threadsafe(lambda: stopped.done() or stopped.set_result(None))
+
+        task = asyncio.ensure_future(self.run(pump, deadline=deadline))
+        try:
+            while True:
+                getter = asyncio.ensure_future(queue.get())
+                await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done() and task.exception() is not None:
+                    # The worker failed or the deadline passed; surface that instead of waiting on the queue
+                    getter.cancel()
+                    task.result()
+                item = await getter
+                if item is finished:
+                    break
+                yield item
+            await task
+        finally:
+            stop.set()
+            if started.is_set():
+                await stopped
+
+    def metrics(self):
+        return {
+            'pool': self.name,
+            'max_concurrency': self.max_concurrency,
+            'queued': self.queued,
+            'active': self.active,
+            'completed': self.completed,
+            'failed': self.failed,
+            'cancelled': self.cancelled,
+        }
+
+
+def interaction_deadline(interaction, margin=5.0):
+    """
+    Convert the expiry of an interaction token into a time.monotonic() deadline, keeping a small margin
+    so there is still time to send the follow-up message.
+    """
+    expires_at = interaction.created_at + INTERACTION_TOKEN_LIFETIME
+    remaining = (expires_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+    return time.monotonic() + remaining - margin
+
+
+llm_pool = WorkerPool("llm", max_workers=int(os.getenv("LLM_WORKERS", 8)))
@@ -0,0 +1,65 @@
+import os
+import random
+from string import Formatter
+
+# When the inference endpoint is slow or failing, a room is rendered from these templates instead of
+# leaving the player waiting. They take the same inputs as the narrative chains in llm.py, so an enemy or
+# treasure reads the same whether its text came from the model or from here. Enemy templates also use
+# the rolled enemy attributes (type, weapon, appearance, strength, weakness).
+
+NARRATIVE_BUDGET_SECONDS = float(os.getenv("NARRATIVE_BUDGET_SECONDS", 10))  # until the first text of a room is shown
+NARRATIVE_STALL_SECONDS = float(os.getenv("NARRATIVE_STALL_SECONDS", 5))  # longest gap allowed between streamed chunks
+
+TEMPLATES = {
+    "start": [
+        " Cold air spills from the mouth of the dungeon as you light your torch. The stone steps are worn smooth by "
+        "countless adventurers before you, and somewhere far below, something is waiting.",
+        " The ancient gate groans open onto a stairway that vanishes into darkness. Moss-covered carvings line the walls, "
+        "telling of riches and of those who never returned.",
+    ],
+    "escape": [
+        " The door swings open without a sound. Beyond it, a narrow stair climbs toward daylight, {properties}, "
+        "and the air smells of rain and open sky.",
+        " Runes around the frame glow as you approach, {properties}. A passage winds upward, away from the dungeon's depths.",
+    ],
+    "enemy": [
+        " Out of the shadows steps a {appearance} {type}, its {weapon} ready. It blocks your path, "
+        "its breath rattling in the cold air.",
+        " Something moves at the edge of the torchlight. A {appearance} {type} known for its {strength} "
+        "lets out a low growl and advances.",
+        " Something stirs in the darkness ahead. It lets out a low growl and advances.",
+    ],
+    "victory": [
+        " You remember the {type}'s {weakness} and turn it against the beast. One final blow, and the {type} "
+        "collapses, never to rise again.",
+        " The {type} lunges, but you sidestep its {weapon} and strike true. It staggers, falls, and moves no more.",
+        " The battle is fierce, but you prevail. Your foe lies still at your feet.",
+    ],
+    "defeat": [
+        " For all its {weakness}, the {type}'s {strength} proves too much. It overwhelms you, and the darkness closes in.",
+        " You strike at the {appearance} {type}, but it answers with its {weapon}, and you fall to the cold stone floor.",
+        " You fight with everything you have, but it is not enough. The darkness closes in.",
+    ],
+    "treasure": [
+        " Brushing aside centuries of dust, you uncover a {treasure}. Its surface glints in the torchlight.",
+        " Behind a loose stone lies a {treasure}, untouched since it was hidden here long ago.",
+    ],
+    "empty": [
+        " The room is bare but for scattered bones and a cold, dead hearth. Water drips steadily somewhere in the dark.",
+        " Dust hangs in the still air of an abandoned chamber. Faded tapestries rot on the walls, and nothing stirs.",
+    ],
+}
+
+
+def render_fallback(chain_name, inputs, attributes=None):
+    """
+    Render a room narrative from the local template library, using the chain inputs and, for enemies,
+    the rolled enemy attributes. Templates needing a value that was not supplied are skipped.
+    """
+    values = {**inputs, **(attributes or {})}
+    templates = [template for template in TEMPLATES[chain_name] if _fields(template) <= values.keys()]
+    return random.choice(templates).format(**values)
+
+
+def _fields(template):
+    return {field for _, field, _, _ in Formatter().parse(template) if field}
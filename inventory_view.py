@@ -0,0 +1,106 @@
+from collections import OrderedDict
+
+import discord
+
+# /inventory shown a page at a time, with rendered pages cached until the player's inventory_version changes.
+
+PAGE_SIZE = 10  # entries per page, keeps each embed field well under Discord's field limit
+INVENTORY_CACHE_SIZE = 1024
+VIEW_TIMEOUT = 180  # seconds the page buttons stay active
+
+
+class InventoryPages:
+    """
+    The pages of one version of a player's inventory: treasures first, then items, numbered as /sell and /use
+    expect.
+    """
+
+    def __init__(self, player):
+        self.player = player
+        self.version = player.inventory_version
+        entries = len(player.inventory) + len(player.items)
+        self.page_count = max(1, -(-entries // PAGE_SIZE))
+        self._embeds = {}
+
+    def page(self, index):
+        embed = self._embeds.get(index)
+        if embed is None:
+            embed = self._embeds[index] = self._render(index)
+        return embed
+
+    def _render(self, index):
+        embed = discord.Embed(title="Your Inventory", color=0x00ff00)
+        inventory, items = self.player.inventory, self.player.items
+        if not inventory and not items:
+            embed.description = "Your inventory is empty."
+            return embed
+
+        start, stop = index * PAGE_SIZE, (index + 1) * PAGE_SIZE
+        if start < len(inventory):
+            lines = [f"{idx + 1}. {treasure}" for idx, treasure in enumerate(inventory[start:stop], start)]
+            embed.add_field(name="Treasures", value="\n".join(lines), inline=False)
+        item_start, item_stop = max(start - len(inventory), 0), max(stop - len(inventory), 0)
+        if item_start < item_stop and item_start < len(items):
+            stacks = self.player.item_stacks()[item_start:item_stop]
+            lines = [f"{idx + 1}. {item} x{quantity}" for idx, (item, quantity) in enumerate(stacks, item_start)]
+            embed.add_field(name="Items", value="\n".join(lines), inline=False)
+        if self.page_count > 1:
+            embed.set_footer(text=f"Page {index + 1}/{self.page_count}")
+        return embed
+
+
+class InventoryCache:
+    def __init__(self, max_entries=INVENTORY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._pages = OrderedDict()  # player name -> InventoryPages
+
+    def get(self, player):
+        """
+        Return the pages for the player's current inventory, reusing the rendered ones if nothing changed.
+        """
+        pages = self._pages.get(player.name)
+        if pages is None or pages.player is not player or pages.version != player.inventory_version:
+            pages = self._pages[player.name] = InventoryPages(player)
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+        self._pages.move_to_end(player.name)
+        return pages
+
+
+class InventoryView(discord.ui.View):
+    """
+    Previous/Next buttons under an inventory message. Only the inventory's owner can use them.
+    """
+
+    def __init__(self, player, timeout=VIEW_TIMEOUT):
+        super().__init__(timeout=timeout)
+        self.player = player
+        self.index = 0
+        self._update_buttons(inventory_pages.get(player))
+
+    def _update_buttons(self, pages):
+        self.previous_page.disabled = self.index == 0
+        self.next_page.disabled = self.index >= pages.page_count - 1
+
+    async def interaction_check(self, interaction):
+        return interaction.user.name == self.player.name
+
+    async def _show(self, interaction):
+        # The inventory may have changed since the message was sent
+        pages = inventory_pages.get(self.player)
+        self.index = max(0, min(self.index, pages.page_count - 1))
+        self._update_buttons(pages)
+        await interaction.response.edit_message(embed=pages.page(self.index), view=self)
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction, button):
+        self.index -= 1
+        await self._show(interaction)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction, button):
+        self.index += 1
+        await self._show(interaction)
+
+
+inventory_pages = InventoryCache()
@@ -0,0 +1,220 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from langchain.prompts import PromptTemplate
+
+from batching import RequestCoalescer
+
+# Pooled clients for the inference endpoint and the narrative prompts, shared by every dungeon.
+
+HF_INFERENCE_URL = "https://api-inference.huggingface.co/models/{repo_id}"
+
+# Generations arriving within LLM_BATCH_WINDOW_MS of each other are sent as one batched request
+LLM_BATCHING = os.getenv("LLM_BATCHING", "1") == "1"
+LLM_BATCH_WINDOW_MS = float(os.getenv("LLM_BATCH_WINDOW_MS", 30))
+LLM_MAX_BATCH_SIZE = int(os.getenv("LLM_MAX_BATCH_SIZE", 16))
+NARRATION_WORKERS = int(os.getenv("NARRATION_WORKERS", 16))
+# Batched requests in flight per model. A window can hold several groups (one per temperature and length),
+# so this must not be lower than the number of generations that could run unbatched.
+LLM_DISPATCH_WORKERS = int(os.getenv("LLM_DISPATCH_WORKERS", NARRATION_WORKERS))
+LLM_BATCH_REPORT_SECONDS = float(os.getenv("LLM_BATCH_REPORT_SECONDS", 300))  # how often batching metrics are printed
+
+
+class LLMProvider:
+    """
+    A pooled client for a single Hugging Face text generation model.
+    Sampling parameters are passed with each request instead of being baked into the client.
+    """
+
+    def __init__(self, repo_id, api_token=None, pool_size=16, timeout=60, batching=LLM_BATCHING):
+        self.repo_id = repo_id
+        self.url = HF_INFERENCE_URL.format(repo_id=repo_id)
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        api_token = api_token or os.getenv("HUGGINGFACEHUB_API_TOKEN")
+        if api_token:
+            self.session.headers["Authorization"] = f"Bearer {api_token}"
+        self.supports_batching = True  # cleared the first time the endpoint rejects a list of inputs
+        self.coalescer = None
+        if batching:
+            self.coalescer = RequestCoalescer(self.generate_batch, window=LLM_BATCH_WINDOW_MS / 1000,
+                                              max_batch_size=LLM_MAX_BATCH_SIZE,
+                                              dispatch_workers=LLM_DISPATCH_WORKERS, name=repo_id,
+                                              report_interval=LLM_BATCH_REPORT_SECONDS)
+
+    def submit(self, prompt, temperature, max_new_tokens):
+        """
+        Queue a generation and return a future for its output, coalescing it with other requests if batching is on.
+        """
+        # Once the endpoint has rejected a list of inputs, holding requests back for a batch gains nothing
+        if self.coalescer is not None and self.supports_batching:
+            return self.coalescer.submit(prompt, temperature, max_new_tokens)
+        return narration_executor.submit(self.generate, prompt, temperature, max_new_tokens)
+
+    def generate_batch(self, prompts, temperature, max_new_tokens):
+        """
+        Generate several prompts with the same parameters in one request. Endpoints that do not accept a
+        list of inputs get the prompts as concurrent single requests instead.
+        """
+        if len(prompts) == 1:
+            return [self.generate(prompts[0], temperature, max_new_tokens)]
+        if self.supports_batching:
+            payload = {
+                "inputs": prompts,
+                "parameters": {
+                    "temperature": temperature,
+                    "max_new_tokens": max_new_tokens,
+                    "return_full_text": False,
+                },
+            }
+            response = self.session.post(self.url, json=payload, timeout=self.timeout)
+            if response.status_code in (400, 422):
+                print(f"{self.repo_id} does not accept batched inputs, sending requests individually")
+                self.supports_batching = False
+            else:
+                response.raise_for_status()
+                result = response.json()
+                if isinstance(result, dict) and "error" in result:
+                    raise ValueError(f"Error raised by inference API: {result['error']}")
+                # Each entry is either a generation or a list holding one generation per input
+                return [(entry[0] if isinstance(entry, list) else entry)["generated_text"] for entry in result]
+        futures = [narration_executor.submit(self.generate, prompt, temperature, max_new_tokens) for prompt in prompts]
+        return [future.result() for future in futures]
+
+    def generate(self, prompt, temperature, max_new_tokens):
+        payload = {
+            "inputs": prompt,
+            "parameters": {
+                "temperature": temperature,
+                "max_new_tokens": max_new_tokens,
+                "return_full_text": False,
+            },
+        }
+        response = self.session.post(self.url, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        result = response.json()
+        if isinstance(result, dict) and "error" in result:
+            raise ValueError(f"Error raised by inference API: {result['error']}")
+        return result[0]["generated_text"]
+
+    def stream(self, prompt, temperature, max_new_tokens):
+        """
+        Yield the generated text token by token as server-sent events arrive.
+        """
+        payload = {
+            "inputs": prompt,
+            "parameters": {
+                "temperature": temperature,
+                "max_new_tokens": max_new_tokens,
+                "return_full_text": False,
+            },
+            "stream": True,
+        }
+        with self.session.post(self.url, json=payload, timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line.startswith(b"data:"):
+                    continue
+                event = json.loads(line[len(b"data:"):])
+                if "error" in event:
+                    raise ValueError(f"Error raised by inference API: {event['error']}")
+                token = event.get("token") or {}
+                if not token.get("special"):
+                    yield token.get("text", "")
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider(repo_id):
+    """
+    Return the shared provider for a model, creating it on first use.
+    """
+    with _providers_lock:
+        provider = _providers.get(repo_id)
+        if provider is None:
+            provider = LLMProvider(repo_id)
+            _providers[repo_id] = provider
+        return provider
+
+
+def batching_metrics():
+    """
+    The coalescer metrics of every model with batching on, keyed by model.
+    """
+    with _providers_lock:
+        return {repo_id: provider.coalescer.metrics() for repo_id, provider in _providers.items()
+                if provider.coalescer is not None}
+
+
+class NarrativeChain:
+    """
+    A reusable replacement for LLMChain. The compiled prompt is shared by every dungeon, while the
+    provider, memory and sampling parameters are supplied on each call.
+    """
+
+    def __init__(self, template, input_key, max_new_tokens, memory_key="adventure_history"):
+        self.input_key = input_key
+        self.memory_key = memory_key
+        self.max_new_tokens = max_new_tokens
+        self.prompt = PromptTemplate(template=template, input_variables=[memory_key, input_key])
+
+    def render(self, memory, **inputs):
+        variables = memory.load_memory_variables(inputs) if memory is not None else {self.memory_key: ""}
+        return self.prompt.format(**variables, **inputs)
+
+    def remember(self, memory, inputs, output):
+        if memory is not None:
+            memory.save_context(inputs, {"text": output})
+
+    def submit(self, provider, memory, temperature, max_new_tokens=None, **inputs):
+        """
+        Start a generation in the background and return its future. The output is not written to
+        memory; call remember() once it has actually been shown to the player.
+        """
+        prompt = self.render(memory, **inputs)
+        return provider.submit(prompt, temperature, max_new_tokens or self.max_new_tokens)
+
+    def stream(self, provider, memory, temperature, max_new_tokens=None, **inputs):
+        """
+        Yield the output as it is generated. Like submit(), the result is not written to memory.
+        """
+        prompt = self.render(memory, **inputs)
+        return provider.stream(prompt, temperature, max_new_tokens or self.max_new_tokens)
+
+
+# Generations are sent on this pool, so independent ones (e.g. the enemy description and the combat outcome)
+# run side by side. It is separate from the bot's worker pools so a room never waits on itself.
+narration_executor = ThreadPoolExecutor(max_workers=NARRATION_WORKERS, thread_name_prefix="narration")
+
+
+CHAINS = {
+    "start": NarrativeChain(
+        "{adventure_history} Paint a vivid picture of a {adventure_type} adventure set in an ancient and mysterious dungeon. What atmosphere and characteristics define this dungeon?",
+        input_key="adventure_type", max_new_tokens=250),
+    "escape": NarrativeChain(
+        "{adventure_history} Amidst the labyrinthine passages, the adventurer discovers a concealed door adorned with {properties}. This is no ordinary room—it's an escape chamber. Elaborate on its enigmatic features.",
+        input_key="properties", max_new_tokens=100),
+    "enemy": NarrativeChain(
+        "{adventure_history} Deep within the dungeon, where distant cries and howls reverberate, the adventurer faces an impending menace. Emerging from the gloom is a {enemy}. Detail its fearsome aspects.",
+        input_key="enemy", max_new_tokens=100),
+    "victory": NarrativeChain(
+        "{adventure_history} Armed with courage and unparalleled skill, the hero confronts the {enemy_description}. Narrate the awe-inspiring moment when the hero triumphs over the creature.",
+        input_key="enemy_description", max_new_tokens=100),
+    "defeat": NarrativeChain(
+        "{adventure_history} Despite the hero's valiant efforts, the {enemy_description} proves to be too powerful. Describe the tragic moment the hero is defeated by the beast.",
+        input_key="enemy_description", max_new_tokens=100),
+    "treasure": NarrativeChain(
+        "{adventure_history} In the depths of the ancient and mystical dungeon, amidst the eerie silence punctuated by the echoes of distant roars and clanks, a hidden chamber reveals itself. Shrouded in mystery, it harbors a {treasure}.",
+        input_key="treasure", max_new_tokens=150),
+    "empty": NarrativeChain(
+        "{adventure_history} Describe an {quality} room in detail.",
+        input_key="quality", max_new_tokens=250),
+}
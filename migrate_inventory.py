@@ -0,0 +1,83 @@
+import argparse
+import asyncio
+
+from firebase_admin import initialize_app, credentials, firestore, firestore_async
+
+from player import Player
+from session import UnitOfWork
+from treasure import Treasure, pack_inventory
+
+# Moves treasures and items from the old subcollections and arrays onto the player document. Run it once,
+# with the bot stopped, before deploying the packed inventory and item stacks:
+#   python migrate_inventory.py --dry-run
+#   python migrate_inventory.py
+
+
+async def migrate_player(db, player_doc, dry_run):
+    data = player_doc.to_dict()
+    session = UnitOfWork(db)
+    player_ref = session.collection('players').document(player_doc.id)
+    migrated = False
+    if 'treasures' not in data:
+        await migrate_treasures(player_ref, data)
+        migrated = True
+    if not isinstance(data.get('items', {}), dict) or await player_ref.collection('items').get():
+        await migrate_items(player_ref, data)
+        migrated = True
+    if migrated and not dry_run:
+        await session.commit()
+    return migrated
+
+
+async def migrate_treasures(player_ref, data):
+    treasures_ref = player_ref.collection('treasures')
+    treasure_docs = await treasures_ref.get()
+    entries = [doc.to_dict() for doc in treasure_docs] or data.get('inventory', [])
+
+    treasures = []
+    for entry in entries:
+        try:
+            treasure = Treasure.from_dict(entry)
+            pack_inventory([treasure])
+        except ValueError:
+            print(f"Skipping unrecognised treasure for {player_ref.id}: {entry}")
+            continue
+        treasures.append(treasure)
+
+    print(f"{player_ref.id}: {len(treasures)} treasures ({len(treasure_docs)} documents, "
+          f"{len(data.get('inventory', []))} array entries)")
+    player_ref.update({'treasures': pack_inventory(treasures), 'inventory': firestore.DELETE_FIELD})
+    treasures_ref.delete_all()
+
+
+async def migrate_items(player_ref, data):
+    items_ref = player_ref.collection('items')
+    item_docs = await items_ref.get()
+    legacy = data.get('items', {})
+    if item_docs:
+        stacks = Player.stack_items([doc.to_dict() for doc in item_docs])
+    else:
+        stacks = Player.stack_items(legacy)
+    stacks.pop(None, None)
+
+    print(f"{player_ref.id}: items {stacks} ({len(item_docs)} documents)")
+    player_ref.update({'items': stacks})
+    items_ref.delete_all()
+
+
+async def main(dry_run):
+    db = firestore_async.client()
+    migrated = 0
+    async for player_doc in db.collection('players').stream():
+        if await migrate_player(db, player_doc, dry_run):
+            migrated += 1
+    print(f"{'Would migrate' if dry_run else 'Migrated'} {migrated} players.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move player treasures into the packed inventory field.")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    args = parser.parse_args()
+
+    initialize_app(credentials.Certificate("firebase.json"))
+    asyncio.run(main(args.dry_run))
@@ -0,0 +1,98 @@
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# Room narratives are generated from a handful of small attribute sets (5 enemy types x 5 weapons x ...,
+# 5 treasure types x 4 materials x 3 origins, and fixed prompts for empty and escape rooms).
+# Once a combination has a few generated variants, rooms rotate through them instead of paying for a new
+# generation each time. Variants live in an in-memory LRU backed by a local SQLite file.
+
+
+class NarrativeCache:
+    def __init__(self, path, variants_per_key=4, max_keys=2048):
+        self.path = path
+        self.variants_per_key = variants_per_key
+        self.max_keys = max_keys
+        self._entries = OrderedDict()  # key -> list of variants, most recently used last
+        self._cursors = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS narratives (key TEXT NOT NULL, variant TEXT NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS narratives_key ON narratives (key)")
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(chain_name, inputs, temperature):
+        """
+        Key a generation on its room type, its attributes and its temperature rounded to one decimal.
+        """
+        return json.dumps([chain_name, sorted(inputs.items()), round(temperature, 1)])
+
+    def _variants(self, key):
+        # Caller holds the lock
+        variants = self._entries.get(key)
+        if variants is None:
+            rows = self._conn.execute("SELECT variant FROM narratives WHERE key = ? ORDER BY rowid", (key,)).fetchall()
+            variants = [row[0] for row in rows]
+            self._entries[key] = variants
+            if len(self._entries) > self.max_keys:
+                evicted, _ = self._entries.popitem(last=False)
+                self._cursors.pop(evicted, None)
+        else:
+            self._entries.move_to_end(key)
+        return variants
+
+    def get(self, key):
+        """
+        Return the next variant for key, or None while the key still needs more variants generated.
+        """
+        with self._lock:
+            variants = self._variants(key)
+            if len(variants) < self.variants_per_key:
+                self.misses += 1
+                return None
+            cursor = self._cursors.get(key, 0)
+            self._cursors[key] = (cursor + 1) % len(variants)
+            self.hits += 1
+            return variants[cursor]
+
+    def add(self, key, variant):
+        with self._lock:
+            variants = self._variants(key)
+            if len(variants) >= self.variants_per_key or variant in variants:
+                return
+            variants.append(variant)
+            self._conn.execute("INSERT INTO narratives (key, variant) VALUES (?, ?)", (key, variant))
+            self._conn.commit()
+
+    def submit(self, chain_name, inputs, temperature, generate):
+        """
+        Return a future for a narrative: already resolved if a cached variant is available, otherwise
+        the future from generate(), whose result is stored as a new variant when it arrives.
+        """
+        key = self.make_key(chain_name, inputs, temperature)
+        cached = self.get(key)
+        if cached is not None:
+            future = Future()
+            future.set_result(cached)
+            return future
+
+        future = generate()
+
+        def store(done):
+            if not done.cancelled() and done.exception() is None:
+                self.add(key, done.result())
+
+        future.add_done_callback(store)
+        return future
+
+
+narrative_cache = NarrativeCache(
+    os.getenv("NARRATIVE_CACHE_PATH", "narratives.sqlite3"),
+    variants_per_key=int(os.getenv("NARRATIVE_CACHE_VARIANTS", 4)),
+)
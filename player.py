@@ -1,8 +1,13 @@
 import random
 from firebase_admin import firestore
-from treasure import Treasure
+from treasure import pack_inventory, unpack_inventory
 from dungeon import Dungeon
-from shop import Item
+from shop import Item, find_item
+from session import write_changes
+from combat import resolve_combat
+
+# Fields whose stored values /buy and /sell check before writing (see UnitOfWork.commit_guarded)
+ECONOMY_FIELDS = ('doubloons', 'treasures', 'items')
 
 class Player:
 
@@ -16,37 +21,28 @@ class Player:
         self.max_health = 100 # This is the maximum health the player can have for now
         self.max_base_damage = 10
         self.inventory = []
-        self.items = []
+        self.items = {}  # item name -> quantity, one stack per kind of item
         self.boost_duration = 0
         self.boosted = False
         self.armor = None
+        self._persisted = None  # the player document as last read or written, None if it doesn't exist yet
+        self.update_time = None  # when the player document was last changed, as of that read or write
+        self.inventory_version = 0  # bumped whenever treasures or items change, to refresh cached inventory pages
 
     def get_stats(self):
         return self.exp, self.health
 
-    def take_damage(self, damage, db):
-        if self.armor is not None:
-            # If player has armor equipped, reduce the damage taken
-            damage -= self.armor.defense_value
-        self.health = max(self.health - damage, 0) # Ensure health does not go below 0
-        response = f"\nYou took {damage} damage and have {self.health} health remaining."
-        if self.health == 0:
-            death_message, lost_treasures = self.die(db)
-            self.dungeon.delete_dungeon(db)  
-            response += f"\n{death_message}\n{lost_treasures}"
-        return response
-
     def die(self, db):
         death_message = "You have died."
-        # Clear inventory and treasures in database
-        self.clear_treasures(db)
-        self.delete_treasures(db)
         # Print out the inventory before it's lost
         if self.inventory:    
             treasures = ', '.join([f"{item}" for item in self.inventory])
             lost_treasures = f"You've lost all your treasures: {treasures}"
         else:
             lost_treasures = "You died with no treasures in your possession."
+        # Clear inventory and treasures in database
+        self.clear_treasures(db)
+        self.delete_treasures(db)
         self.reset_player()  # Now reset the player's state including the inventory
         self.dungeon.delete_dungeon(db)  # finally delete the dungeon document from the db
         return death_message, lost_treasures
@@ -56,22 +52,22 @@ class Player:
         self.clear_treasures(db)
         # Reset the player's state
         self.reset_player()
-        self.clear_treasures(db)
         self.dungeon.delete_dungeon(db)
         return "You have fled the dungeon. You have lost all your treasures and doubloons."
 
     def clear_treasures(self, db):
-        # Run a query to fetch all the treasure documents for the given player
-        treasures_reference = db.collection('players').document(self.name).collection('treasures')
-        treasures_snapshot = treasures_reference.stream()
-        # Iterate through the snapshot and delete each document (treasure)
-        for treasure_doc in treasures_snapshot:
-            treasure_doc.reference.delete()
+        self.inventory = []
+        self.inventory_changed()
+        self.save_to_db(db)
         print(f"Treasures cleared for player {self.name}")
 
+    def inventory_changed(self):
+        self.inventory_version += 1
+
     def use_treasure(self, index):
         if index < len(self.inventory):
             treasure = self.inventory.pop(index)  # Remove and get the treasure from the inventory
+            self.inventory_changed()
             return f'You used the {treasure}. Effect: {treasure.use()}'
         else:
             return "Invalid index. No such treasure in the inventory."
@@ -81,44 +77,28 @@ class Player:
         self.doubloons = 0
         self.health = 100
         self.inventory = []
+        self.inventory_changed()
 
     def gain_experience(self, amount, db):
         self.experience += amount
         print(f"You gained {amount} experience points!")
-        self.save_to_db(db)  # Update the database whenever player's state changes
-
-    def handle_combat(self, enemy_threat_level, db):
-        # Calculate combat outcome
-        combat_message = ""
-        combat_outcome = "ongoing"
-        while self.health > 0 and enemy_threat_level > 0:
-            player_attack = random.randint(0, self.max_base_damage)
-            enemy_attack = random.randint(0, enemy_threat_level)
-
-            # Player attacks
-            enemy_threat_level -= player_attack
-
-            # Enemy attacks if it's still alive
-            if enemy_threat_level > 0:
-                combat_message += self.take_damage(enemy_attack, db)
-
-            # Append to combat message
-            combat_message += (f"Player dealt {player_attack} damage to the enemy.\n"
-                            f"Enemy dealt {enemy_attack} damage to the player.\n"
-                            "---\n")
-
-        if self.health > 0:
-            combat_outcome = "won"
-            
-        if enemy_threat_level <= 0 or self.health <= 0:
-            combat_outcome = "lost"
-            death_message, lost_treasures = self.die(db)
-            self.dungeon.delete_dungeon(db)
-            combat_message += f"\n{death_message}\n{lost_treasures}"
+        # Persisted by the save_to_db at the end of the command
 
+    def handle_combat(self, enemy_threat_level, db, rng=random):
+        """
+        Resolve a fight and apply its result to the player once. Returns the CombatOutcome and the text
+        to show after the combat log (the death message, if the player died).
+        """
+        armor_defense = (self.armor.defense_value or 0) if self.armor is not None else 0
+        outcome = resolve_combat(self.health, self.max_base_damage, enemy_threat_level, armor_defense, rng)
+        self.health = outcome.final_health
+        if outcome.died:
+            # die also deletes the dungeon
+            death_message, lost_treasures = self.die(db)
+            return outcome, f"\n{death_message}\n{lost_treasures}"
         # Award experience - this can be modified as per the game's logic
-        self.gain_experience(enemy_threat_level, db)
-        return combat_outcome, combat_message
+        self.gain_experience(outcome.experience, db)
+        return outcome, ""
 
     def award_exp(self, exp):
         self.experience += exp
@@ -141,39 +121,56 @@ class Player:
             'doubloons': self.doubloons,
             'health': self.health,
             'max_base_damage': self.max_base_damage,
-            'inventory': self.inventory,
+            'inventory': [treasure.to_dict() for treasure in self.inventory],
             'items': self.items,
         }
 
-    def save_to_db(self, db):
-        print(f"Saving player {self.name} to database.")
-        print(f"Player's inventory: {self.inventory}")
-        player_ref = db.collection('players').document(self.name)
-        # Serialize Treasure objects in inventory before saving to Firestore
-        serialized_inventory = [item.to_dict() if hasattr(item, 'to_dict') else item for item in self.inventory]
-        # Create a copy of self.__dict__ and replace 'inventory' with the serialized version
-        data_to_save = self.__dict__.copy()
-        data_to_save['inventory'] = serialized_inventory
-        print("data to save: " + str(data_to_save))
-
-        # Serialize Item objects in items before saving to Firestore
-        serialized_items = [item.to_dict() if hasattr(item, 'to_dict') else item for item in self.items]
-        data_to_save['items'] = serialized_items
-
+    def to_record(self):
+        """
+        The fields stored in the player document. Treasures are kept in their packed form.
+        """
+        record = {
+            'name': self.name,
+            'level': self.level,
+            'experience': self.experience,
+            'exp': self.exp,
+            'doubloons': self.doubloons,
+            'health': self.health,
+            'max_health': self.max_health,
+            'max_base_damage': self.max_base_damage,
+            'treasures': pack_inventory(self.inventory),
+            'items': dict(self.items),
+            'boost_duration': self.boost_duration,
+            'boosted': self.boosted,
+            'armor': self.armor.to_dict() if hasattr(self.armor, 'to_dict') else self.armor,
+        }
         # Serialize Dungeon object if it exists
         if hasattr(self, "dungeon") and isinstance(self.dungeon, Dungeon):
-            data_to_save['dungeon'] = self.dungeon.to_dict()
-        #if hasattr(self, "inventory"):
-        #    data_to_save["inventory"] = [item for item in self.inventory]
+            record['dungeon'] = self.dungeon.to_dict()
+        return record
+
+    def economy_snapshot(self):
+        """
+        The economy fields as this Player last read or wrote them. Take it before changing anything.
+        """
+        if self._persisted is None:
+            return {}
+        return {key: self._persisted.get(key) for key in ECONOMY_FIELDS}
 
-        # Save to Firestore
-        player_ref.set(data_to_save, merge=True)
+    def save_to_db(self, db):
+        player_ref = db.collection('players').document(self.name)
+        # Only the fields that changed since the last read or write are sent
+        self._persisted, changed = write_changes(player_ref, self._persisted, self.to_record(), merge=True,
+                                               owner=self)
+        if changed:
+            print(f"Saving player {self.name} to database: {', '.join(changed)}")
 
 
     @staticmethod
-    async def load_from_db(player_name, db):
-        player_ref = db.collection('players').document(player_name)
-        player_doc = player_ref.get()
+    def from_snapshots(player_name, player_doc):
+        """
+        Build a Player from the player document, which carries the packed inventory and the item stacks.
+        """
         if player_doc.exists:
             player_data = player_doc.to_dict()
             player = Player(player_data['name'])
@@ -183,16 +180,14 @@ class Player:
             player.doubloons = player_data.get('doubloons',0)
             player.health = player_data.get('health', 100)
             player.max_base_damage = player_data.get('max_base_damage', 10)
+            player._persisted = player_data
+            player.update_time = player_doc.update_time
 
             # Load player's treasures
-            treasures_ref = db.collection('players').document(player.name).collection('treasures')
-            treasures_docs = treasures_ref.get()
-            player.inventory = [Treasure.from_dict(doc.to_dict()) for doc in treasures_docs]
+            player.inventory = unpack_inventory(player_data.get('treasures'))
 
             # Load player's items
-            items_ref = db.collection('players').document(player.name).collection('items')
-            items_docs = items_ref.get()
-            player.items = [Item.from_dict(doc.to_dict()) for doc in items_docs]
+            player.items = Player.stack_items(player_data.get('items', {}))
 
             return player
         else:
@@ -200,11 +195,10 @@ class Player:
             return player
         
     def add_to_inventory(self, treasure, db):
-        self.inventory.append(treasure.to_dict())
-        # add treasure to the player document treasure collection
-        treasure_ref = db.collection('players').document(self.name).collection('treasures').document()
-        treasure.id = treasure_ref.id   # Get the id of the document for the treasure
-        treasure_ref.set(treasure.to_dict())
+        self.inventory.append(treasure)
+        self.inventory_changed()
+        # A single write to the player document, folded into the command's other player writes
+        self.save_to_db(db)
         print(f"Added {treasure} to player's inventory.")
 
 
@@ -218,9 +212,7 @@ class Player:
     def sell_item(self, index, db):
         if isinstance(index, int) and 0 <= index < len(self.inventory):
             sold_item = self.inventory.pop(index)
-            # Use the id attribute of the treasure to delete the corresponding document in Firebase
-            sold_treasure_ref = db.collection('players').document(self.name).collection('treasures').document(sold_item.id)
-            sold_treasure_ref.delete()
+            self.inventory_changed()
             self.doubloons += sold_item.value
             # Save player's state to the database after selling an item
             self.save_to_db(db)
@@ -231,13 +223,9 @@ class Player:
         elif isinstance(index, str) and index.lower() == 'all':
             total_value = sum(item.value for item in self.inventory)
             self.doubloons += total_value
-            self.inventory = []
 
             # Delete all treasures from the database
-            treasures_ref = db.collection('players').document(self.name).collection('treasures')
-            treasures_docs = treasures_ref.get()
-            for treasure_doc in treasures_docs:
-                treasure_doc.reference.delete()
+            self.clear_treasures(db)
                     
             # Save player's state to the database after selling all items
             self.save_to_db(db)
@@ -247,25 +235,46 @@ class Player:
             return "Invalid command. Please enter a valid index or 'all'."
                     
                     
-    def add_to_items(self, item, db):
-        self.items.append(item.to_dict())  # Convert to dictionary before appending
-        # add item to the player document item collection
-        item_ref = db.collection('players').document(self.name).collection('items').document()
-        item.id = item_ref.id   # Get the id of the document for the item
-        item_ref.set(item.to_dict())
-        print(f"Added {item} to player's items.")
+    @staticmethod
+    def stack_items(items):
+        if isinstance(items, dict):
+            return dict(items)
+        # Saved before items were stacked: a list with one entry per item
+        stacks = {}
+        for entry in items:
+            name = entry.get('name') if isinstance(entry, dict) else entry
+            stacks[name] = stacks.get(name, 0) + 1
+        return stacks
+
+    def item_stacks(self):
+        """
+        The player's items as (Item, quantity) pairs, in the order /inventory numbers them for /use.
+        """
+        return [(find_item(name) or Item(name, 0, ""), quantity) for name, quantity in self.items.items()]
+
+    def add_to_items(self, item, db, quantity=1):
+        self.items[item.name] = self.items.get(item.name, 0) + quantity
+        self.inventory_changed()
+        # The whole stack map is one field on the player document
+        self.save_to_db(db)
+        print(f"Added {quantity} x {item} to player's items.")
 
     def use_item(self, item_index, db):
         """
         Use an item from the players items. The effect of the item will be 
         applied to the player. 
-        :param item_index: The index of the item in the items attr.
+        :param item_index: The index of the item stack in the items attr.
         """
         if item_index < 0 or item_index >= len(self.items):
             return "Invalid item index. Please provide an index between 1 and "+str(len(self.items))+"."
 
-        # Remove the item from the inventory
-        item = self.items.pop(item_index)
+        # Take one item from its stack
+        item, quantity = self.item_stacks()[item_index]
+        if quantity > 1:
+            self.items[item.name] = quantity - 1
+        else:
+            del self.items[item.name]
+        self.inventory_changed()
 
         # The nature of the effect depends on what the item is. This 
         # is just an example which assumes that the item is a potion 
@@ -0,0 +1,66 @@
+import threading
+import time
+
+# Players spend a while reading each room before typing /continue. The next room is picked as soon as a
+# response has been sent and its narrative is generated in the background into a per-player slot,
+# so the following /continue usually only has to collect it.
+
+
+class PrefetchedRoom:
+    """
+    A room chosen ahead of time. future resolves to the narrative that opens it.
+    """
+
+    def __init__(self, depth, threat_level, encounter, details, chain_name, inputs, future):
+        self.depth = depth
+        self.threat_level = threat_level
+        self.encounter = encounter
+        self.details = details
+        self.chain_name = chain_name
+        self.inputs = inputs
+        self.future = future
+        self.created_at = time.monotonic()
+
+    def matches(self, depth, threat_level):
+        return self.depth == depth and self.threat_level == threat_level
+
+
+class PrefetchSlots:
+    """
+    One prefetched room per player. A room is only handed out for the depth and threat level it was
+    rolled for; anything else is discarded.
+    """
+
+    def __init__(self, max_age=15 * 60):
+        self.max_age = max_age
+        self._slots = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, player_name, room):
+        with self._lock:
+            previous = self._slots.get(player_name)
+            self._slots[player_name] = room
+        if previous is not None:
+            previous.future.cancel()
+
+    def take(self, player_name, depth, threat_level):
+        with self._lock:
+            room = self._slots.pop(player_name, None)
+        if room is None or not room.matches(depth, threat_level) or time.monotonic() - room.created_at > self.max_age:
+            if room is not None:
+                room.future.cancel()
+            self.misses += 1
+            return None
+        self.hits += 1
+        return room
+
+    def invalidate(self, player_name):
+        with self._lock:
+            room = self._slots.pop(player_name, None)
+        if room is not None:
+            room.future.cancel()
+
+
+prefetch_slots = PrefetchSlots()
@@ -0,0 +1,56 @@
+import argparse
+
+import rng
+from combat import resolve_combat
+
+# Regenerates the rooms of a run from the seed stored in its dungeon document, to reproduce slow or buggy runs.
+# Only the rolls are replayed, so this needs neither the LLM nor Firestore.
+#   python replay.py --seed 1234567890 --rooms 20
+
+
+def replay(seed, rooms, health=100, max_base_damage=10, threat_level=1, multiplier=1.5, max_threat_level=5):
+    """
+    Regenerate the rooms of a run from its seed. Assumes the player started at full health without armor,
+    used no items and continued past every escape room.
+    Yields (depth, threat_level, encounter, details, combat outcome or None) until the player dies.
+    """
+    for depth in range(1, rooms + 1):
+        encounter = rng.roll_encounter(rng.room_stream(seed, depth, "encounter"), threat_level)
+        details, _, _ = rng.plan_room(seed, encounter, depth)
+        combat = None
+        if encounter == "combat":
+            combat = resolve_combat(health, max_base_damage, threat_level,
+                                    rng=rng.room_stream(seed, depth, "combat"))
+            health = combat.final_health
+        yield depth, threat_level, encounter, details, combat
+        if combat is not None and combat.died:
+            return
+        # As in Dungeon.update_threat_level
+        threat_level = min(threat_level * multiplier, max_threat_level)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the rooms of a dungeon run from its seed.")
+    parser.add_argument("--seed", type=int, required=True, help="the 'seed' field of the dungeon document")
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--health", type=int, default=100, help="the player's health when the run started")
+    parser.add_argument("--multiplier", type=float, default=1.5, help="threat_level_multiplier")
+    parser.add_argument("--max-threat", type=float, default=5, help="max_threat_level")
+    args = parser.parse_args()
+
+    for depth, threat_level, encounter, details, combat in replay(args.seed, args.rooms, args.health,
+                                                                  multiplier=args.multiplier,
+                                                                  max_threat_level=args.max_threat):
+        line = f"{depth:3}  threat {threat_level:5.2f}  {encounter}"
+        if "enemy" in details:
+            line += f": {rng.describe_enemy(details['enemy'])}"
+        if "treasure" in details:
+            line += f": {details['treasure']}"
+        print(line)
+        if combat is not None:
+            print(f"     {len(combat.rounds)} rounds, dealt {combat.damage_dealt}, took {combat.damage_taken}, "
+                  f"{'won' if combat.won else 'died'} with {combat.final_health} health")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import itertools
+import random
+import secrets
+from functools import lru_cache
+
+from treasure import Treasure, TREASURE_TYPES, MATERIALS, ORIGINS
+
+# Every dungeon draws its randomness from its own seed, which is stored in the dungeon document. Each room has
+# independent streams per purpose (encounter, enemy, treasure, combat) derived from the seed, the depth and
+# the purpose. A room therefore rolls the same whether it was prefetched or rolled when played, and a whole
+# run can be regenerated from its seed (see replay.py). Nothing here needs the LLM or the database.
+
+ENCOUNTERS = ["combat", "treasure", "nothing", "escape"]
+
+
+def new_seed():
+    return secrets.randbits(63)
+
+
+def room_stream(seed, depth, purpose):
+    # Seeding with a string hashes it with SHA-512, so streams are identical across processes and restarts
+    return random.Random(f"{seed}:{depth}:{purpose}")
+
+
+@lru_cache(maxsize=None)
+def encounter_table(threat_level):
+    """
+    Cumulative encounter weights for a threat level, in ENCOUNTERS order. Built once per threat level.
+    """
+    weights = [
+        threat_level,  # combat
+        max(1, 10 - threat_level),  # treasure
+        max(1, 5 - threat_level),  # nothing
+        max(1, 10 - threat_level),  # escape
+    ]
+    return tuple(itertools.accumulate(weights))
+
+
+def roll_encounter(rng, threat_level):
+    return rng.choices(ENCOUNTERS, cum_weights=encounter_table(threat_level))[0]
+
+
+def roll_enemy(seed, depth):
+    stream = room_stream(seed, depth, "enemy")
+    return {
+        "type": stream.choice(["goblin", "troll", "dragon", "skeleton", "zombie"]),
+        "weapon": stream.choice(["claws", "sword", "magic", "fangs", "axe"]),
+        "appearance": stream.choice(["horrifying", "grotesque", "terrifying", "ghastly", "hideous"]),
+        "strength": stream.choice(["immense strength", "magical powers", "swift agility", "overwhelming numbers", "deadly precision"]),
+        "weakness": stream.choice(["fear of light", "slow movements", "limited vision", "low intelligence", "magic susceptibility"])
+    }
+
+
+def describe_enemy(enemy_attributes):
+    return f'A {enemy_attributes["appearance"]} {enemy_attributes["type"]} wielding a {enemy_attributes["weapon"]} with {enemy_attributes["strength"]}, but has a {enemy_attributes["weakness"]}'
+
+
+def roll_treasure(seed, depth):
+    stream = room_stream(seed, depth, "treasure")
+    treasure_type = stream.choice(TREASURE_TYPES)
+    material = stream.choice(MATERIALS)
+    origin = stream.choice(ORIGINS)
+
+    return Treasure(treasure_type, material, origin, rng=stream)
+
+
+def plan_room(seed, encounter, depth):
+    """
+    Roll everything about a room that does not depend on the player.
+    Returns the room details and the chain name and inputs of the narrative that opens it.
+    """
+    if encounter == "combat":
+        enemy_attributes = roll_enemy(seed, depth)
+        return {"enemy": enemy_attributes}, "enemy", {"enemy": describe_enemy(enemy_attributes)}
+    if encounter == "treasure":
+        treasure = roll_treasure(seed, depth)
+        return {"treasure": treasure}, "treasure", {"treasure": str(treasure)}
+    if encounter == "nothing":
+        return {}, "empty", {"quality": "empty"}
+    return {}, "escape", {"properties": "bathed in white light"}
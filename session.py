@@ -0,0 +1,278 @@
+# Collects a command's Firestore writes and sends them together when the command finishes.
+
+import asyncio
+
+from google.api_core.exceptions import FailedPrecondition
+from google.cloud.firestore import async_transactional
+
+MAX_BATCH_WRITES = 500  # Firestore's limit on writes in a single batch
+
+_MISSING = object()
+
+
+def collection_path(ref):
+    return f"{ref.parent.path}/{ref.id}" if ref.parent is not None else ref.id
+
+
+async def bulk_delete(db, collection_ref, page_size=MAX_BATCH_WRITES):
+    """
+    Delete every document in a collection. Document names are paged through without their fields, and
+    each page is deleted with one batch commit that runs while the next page is being fetched.
+    """
+    query = collection_ref.select([]).order_by('__name__').limit(page_size)
+    commits = []
+    deleted = 0
+    page = await query.get()
+    while page:
+        batch = db.batch()
+        for snapshot in page:
+            batch.delete(snapshot.reference)
+        commits.append(asyncio.ensure_future(batch.commit()))
+        deleted += len(page)
+        if len(page) < page_size:
+            break
+        page = await query.start_after(page[-1]).get()
+    await asyncio.gather(*commits)
+    return deleted
+
+
+def write_changes(ref, persisted, data, merge=False, owner=None):
+    """
+    Stage a document write containing only the fields of data that differ from persisted, the fields as last
+    read from or written to Firestore. Nothing is staged when no field changed, and the whole document is set
+    when there is no persisted copy. Returns the new persisted copy and the names of the fields written.
+    owner is the object the copy belongs to; see UnitOfWork.update.
+    """
+    if persisted is None:
+        ref.set(data, merge=merge, owner=owner)
+        return dict(data), list(data)
+    changes = {key: value for key, value in data.items() if persisted.get(key, _MISSING) != value}
+    if changes:
+        ref.update(changes, owner=owner)
+    return {**persisted, **changes}, list(changes)
+
+
+class StaleWrite(Exception):
+    """
+    Raised when a document no longer holds the values the writes were based on: by commit_guarded, and by
+    commit when a document was changed since its owner read or wrote it.
+    """
+
+
+class UnitOfWork:
+    """
+    Stands in for the Firestore AsyncClient during a command. Reads are awaited as usual; writes are folded
+    together per document and sent by commit(). Staging a write does no IO, so Player and Dungeon can stage
+    from the narrative worker threads.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._writes = {}  # document path -> (kind, reference, data, merge, owner)
+        self._cleared_collections = {}  # collection path -> reference, emptied before the writes are sent
+        self.committed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.commit()
+
+    def collection(self, name):
+        return CollectionProxy(self, self.db.collection(name))
+
+    @property
+    def pending_writes(self):
+        return len(self._writes) + len(self._cleared_collections)
+
+    def set(self, ref, data, merge=False, owner=None):
+        previous = self._writes.get(ref.path)
+        if merge and previous is not None and previous[0] != 'delete':
+            kind, _, previous_data, previous_merge, previous_owner = previous
+            # Merging into an update keeps the update's requirement that the document exists
+            self._writes[ref.path] = (kind, ref, {**previous_data, **data}, previous_merge, previous_owner or owner)
+        else:
+            self._writes[ref.path] = ('set', ref, dict(data), merge and previous is None, owner)
+
+    def update(self, ref, data, owner=None):
+        """
+        Stage an update. If owner (the Player or Dungeon the data comes from) has an update_time, the update is
+        only applied if the document hasn't changed since then, so a cached copy never overwrites changes made
+        elsewhere (admin scripts, console edits, another instance). owner.update_time follows each commit.
+        """
+        previous = self._writes.get(ref.path)
+        if previous is not None and previous[0] != 'delete':
+            kind, _, previous_data, merge, previous_owner = previous
+            self._writes[ref.path] = (kind, ref, {**previous_data, **data}, merge, previous_owner or owner)
+        else:
+            self._writes[ref.path] = ('update', ref, dict(data), False, owner)
+
+    def delete(self, ref):
+        self._writes[ref.path] = ('delete', ref, None, False, None)
+
+    def _apply(self, target, writes):
+        for kind, ref, data, merge, owner in writes:
+            if kind == 'set':
+                target.set(ref, data, merge=merge)
+            elif kind == 'update':
+                if owner is not None and owner.update_time is not None:
+                    target.update(ref, data, option=self.db.write_option(last_update_time=owner.update_time))
+                else:
+                    target.update(ref, data)
+            else:
+                target.delete(ref)
+
+    @staticmethod
+    def _written(writes, results):
+        for (kind, _, _, _, owner), result in zip(writes, results):
+            if owner is not None and kind != 'delete':
+                owner.update_time = result.update_time
+
+    def delete_collection(self, ref):
+        """
+        Empty a collection when the session commits. Writes already staged for its documents are dropped,
+        while documents written after this call are kept.
+        """
+        path = collection_path(ref)
+        self._cleared_collections[path] = ref
+        for document_path in [key for key in self._writes if key.rsplit('/', 1)[0] == path]:
+            del self._writes[document_path]
+
+    def discard(self):
+        """
+        Drop everything staged so far, e.g. to redo a command on freshly loaded objects.
+        """
+        self._writes.clear()
+        self._cleared_collections.clear()
+
+    async def commit_guarded(self, ref, expected):
+        """
+        Send the staged writes in a Firestore transaction that first reads ref and checks that each field in
+        expected still has that value. Used for economy writes, so doubloons or items computed from a stale copy
+        (e.g. changed by another bot instance) are never written. Raises StaleWrite if a field changed;
+        contention between transactions is retried by Firestore.
+        """
+        if self._cleared_collections:
+            raise ValueError("Collection deletes can't be part of a transaction.")
+        writes = list(self._writes.values())
+
+        @async_transactional
+        async def apply(transaction):
+            snapshot = await ref.get(transaction=transaction)
+            current = snapshot.to_dict() or {}
+            for key, value in expected.items():
+                if current.get(key) != value:
+                    raise StaleWrite(f"{ref.path} field '{key}' changed since it was read.")
+            self._apply(transaction, writes)
+
+        transaction = self.db.transaction()
+        try:
+            await apply(transaction)
+        except FailedPrecondition as e:
+            raise StaleWrite(f"A document was changed since it was read: {e}") from e
+        self._written(writes, transaction.write_results)
+        self._writes.clear()
+        self.committed = True
+        return len(writes)
+
+    async def commit(self):
+        """
+        Empty the cleared collections, then send every collected write. Commands stay well under the
+        batch limit; larger ones are split.
+        """
+        for ref in self._cleared_collections.values():
+            await bulk_delete(self.db, ref)
+        self._cleared_collections.clear()
+        writes = list(self._writes.values())
+        for start in range(0, len(writes), MAX_BATCH_WRITES):
+            chunk = writes[start:start + MAX_BATCH_WRITES]
+            batch = self.db.batch()
+            self._apply(batch, chunk)
+            try:
+                results = await batch.commit()
+            except FailedPrecondition as e:
+                raise StaleWrite(f"A document was changed since it was read: {e}") from e
+            self._written(chunk, results)
+        # Only forgotten once they are written, so a failed commit still shows as pending
+        self._writes.clear()
+        self.committed = True
+        return len(writes)
+
+
+class CollectionProxy:
+    def __init__(self, session, ref):
+        self.session = session
+        self.ref = ref
+
+    @property
+    def id(self):
+        return self.ref.id
+
+    def document(self, document_id=None):
+        return DocumentProxy(self.session, self.ref.document(document_id))
+
+    def add(self, data):
+        document = self.document()
+        document.set(data)
+        return None, document
+
+    async def stream(self):
+        async for snapshot in self.ref.stream():
+            yield SnapshotProxy(self.session, snapshot)
+
+    async def get(self):
+        return [SnapshotProxy(self.session, snapshot) for snapshot in await self.ref.get()]
+
+    def delete_all(self):
+        self.session.delete_collection(self.ref)
+
+
+class DocumentProxy:
+    def __init__(self, session, ref):
+        self.session = session
+        self.ref = ref
+
+    @property
+    def id(self):
+        return self.ref.id
+
+    @property
+    def path(self):
+        return self.ref.path
+
+    def collection(self, name):
+        return CollectionProxy(self.session, self.ref.collection(name))
+
+    async def get(self):
+        return await self.ref.get()
+
+    def set(self, data, merge=False, owner=None):
+        self.session.set(self.ref, data, merge=merge, owner=owner)
+
+    def update(self, data, owner=None):
+        self.session.update(self.ref, data, owner=owner)
+
+    def delete(self):
+        self.session.delete(self.ref)
+
+
+class SnapshotProxy:
+    """
+    A read snapshot whose reference stages writes in the session instead of sending them.
+    """
+
+    def __init__(self, session, snapshot):
+        self._snapshot = snapshot
+        self.reference = DocumentProxy(session, snapshot.reference)
+
+    @property
+    def id(self):
+        return self._snapshot.id
+
+    @property
+    def exists(self):
+        return self._snapshot.exists
+
+    def to_dict(self):
+        return self._snapshot.to_dict()
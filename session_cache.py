@@ -0,0 +1,163 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+
+from player import Player
+from dungeon import Dungeon
+
+# Live Player and Dungeon objects per Discord user, so back-to-back commands don't reload them from Firestore.
+
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", 300))
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", 1024))
+
+
+async def load_session(name, db):
+    """
+    Load a user's Player and Dungeon in one round trip: the player document (which carries the inventory and
+    items) and the dungeon document are read concurrently. The dungeon is None outside a run.
+    """
+    player_doc, dungeon_doc = await asyncio.gather(
+        db.collection('players').document(name).get(),
+        db.collection('dungeons').document(name).get(),
+    )
+    player = Player.from_snapshots(name, player_doc)
+    return player, Dungeon.from_snapshot(player, db, dungeon_doc)
+
+
+class CachedSession:
+    def __init__(self, player, dungeon, expires_at):
+        self.player = player
+        self.dungeon = dungeon
+        self.expires_at = expires_at
+
+
+class SessionCache:
+    def __init__(self, ttl=SESSION_TTL_SECONDS, max_entries=SESSION_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._pinned = set()  # users with a command running that may change their entry
+        self.hits = 0
+        self.misses = 0
+
+    def _entry(self, name):
+        entry = self._entries.get(name)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic() and name not in self._pinned:
+            del self._entries[name]
+            return None
+        self._entries.move_to_end(name)
+        return entry
+
+    async def player(self, name, db):
+        """
+        Return the live Player for a user. On a miss the Player and their Dungeon are loaded together.
+        """
+        entry = self._entry(name)
+        if entry is not None:
+            self.hits += 1
+            return entry.player
+        self.misses += 1
+        player, dungeon = await load_session(name, db)
+        entry = self._entry(name)
+        if entry is not None:
+            # Another command (a read-only one runs outside the user's turn) loaded the session meanwhile;
+            # keep the objects it may already be changing
+            return entry.player
+        self._entries[name] = CachedSession(player, dungeon, time.monotonic() + self.ttl)
+        for oldest in list(self._entries):
+            if len(self._entries) <= self.max_entries:
+                break
+            if oldest not in self._pinned:
+                del self._entries[oldest]
+        return player
+
+    async def peek_player(self, name, db):
+        """
+        Return the cached Player for a read-only command, or on a miss a freshly loaded copy that is not cached.
+        Caching it could replace the entry of a command that is about to commit a newer state.
+        """
+        entry = self._entry(name)
+        if entry is not None:
+            self.hits += 1
+            return entry.player
+        self.misses += 1
+        player, _ = await load_session(name, db)
+        return player
+
+    @contextmanager
+    def pinned(self, name):
+        """
+        Keep a user's entry from expiring or being evicted while a command that may change it runs, so the
+        objects it commits are the ones later commands get. The entry's TTL restarts when the command ends.
+        """
+        self._pinned.add(name)
+        try:
+            yield
+        finally:
+            self._pinned.discard(name)
+            entry = self._entries.get(name)
+            if entry is not None:
+                entry.expires_at = time.monotonic() + self.ttl
+
+    async def dungeon(self, player, db):
+        """
+        Return the player's live Dungeon, or None if they are not in one. Call after player().
+        """
+        entry = self._entry(player.name)
+        if entry is None or entry.player is not player:
+            return await Dungeon.load_dungeon(player, db)
+        if entry.dungeon is not None and entry.dungeon.deleted:
+            # The run ended through death, /flee or /escape
+            entry.dungeon = None
+        return entry.dungeon
+
+    def set_dungeon(self, name, dungeon):
+        entry = self._entry(name)
+        if entry is not None:
+            entry.dungeon = dungeon
+
+    def invalidate(self, name):
+        """
+        Drop a user's cached Player and Dungeon. The next command reloads them from Firestore.
+        Changes made outside this process (admin scripts, console edits, another instance) don't need it: writes
+        from a cached copy carry its update_time, the commit is refused with StaleWrite, and run_command drops
+        the session because its writes stayed pending.
+        """
+        self._entries.pop(name, None)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class CommandQueue:
+    """
+    Runs each user's commands one at a time, in the order they arrived, so overlapping commands (a /sell sent
+    while a /continue is still playing) never change the same cached Player at once. Commands of different users
+    still run concurrently.
+    """
+
+    def __init__(self):
+        self._locks = {}  # user name -> asyncio.Lock, while the user has a command running or waiting
+        self._pending = {}  # user name -> number of commands running or waiting
+
+    @asynccontextmanager
+    async def turn(self, name):
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        self._pending[name] = self._pending.get(name, 0) + 1
+        try:
+            # asyncio.Lock hands itself to waiters in arrival order
+            async with lock:
+                yield
+        finally:
+            self._pending[name] -= 1
+            if not self._pending[name]:
+                del self._pending[name]
+                del self._locks[name]
+
+
+sessions = SessionCache()
+command_queue = CommandQueue()
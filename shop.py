@@ -1,3 +1,7 @@
+import json
+import os
+import time
+
 class Item:
     def __init__(self, name, cost, description):
         self.name = name
@@ -36,28 +40,84 @@ class Item:
         else:       
             return f"You used the {self.name}. Its {self.description}."
 
+# The catalog is read from SHOP_ITEMS_PATH, so items can be added or repriced without a code change.
+# shop_catalog holds the current Shop for the whole process. It checks the file's modification time at most
+# every SHOP_RELOAD_INTERVAL seconds and swaps in a freshly loaded Shop when it changed. A Shop never changes
+# after it is built, so handlers can keep using the one they got while a reload happens.
+SHOP_ITEMS_PATH = os.getenv("SHOP_ITEMS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "shop_items.json"))
+SHOP_RELOAD_INTERVAL = float(os.getenv("SHOP_RELOAD_INTERVAL", 5))
+
+
 class Shop:
-    def __init__(self):
-        self.items = [
-            Item("health_potion", 10, "Restores 50 points of health."),
-            Item("strength_potion", 20, "Increases attack power by 5 for the next 3 turns."),
-            # additional items could be added here
-        ]
+    def __init__(self, items):
+        self.items = tuple(items)
+        self.items_by_name = {item.name: item for item in self.items}
+        self.display = "\n".join([f"{idx+1}. {item.name} - {item.cost} doubloons - {item.description}" for idx, item in enumerate(self.items)])
+
+    @staticmethod
+    def load(path):
+        with open(path) as f:
+            return Shop([Item.from_dict(data) for data in json.load(f)])
 
     def get_shop_display(self):
-        return "\n".join([f"{idx+1}. {item.name} - {item.cost} doubloons - {item.description}" for idx, item in enumerate(self.items)])
+        return self.display
 
-    def buy(self, item_index, player, db):
+    def find(self, name):
+        return self.items_by_name.get(name)
+
+    def buy(self, item_index, player, db, quantity=1):
+        if item_index < 0 or item_index >= len(self.items):
+            raise ValueError("Invalid item index. Please try again.")
+        item = self.items[item_index]
+        if quantity < 1:
+            raise ValueError("You must buy at least one item!")
+        total_cost = item.cost * quantity
         # check if player has enough doubloons
-        if player.doubloons < self.items[item_index].cost:
-            raise Exception("You don't have enough doubloons!")
+        if player.doubloons < total_cost:
+            raise ValueError("You don't have enough doubloons!")
         # deduct doubloons
-        player.doubloons -= self.items[item_index].cost
-        # Add item to player's in-memory inventory
-        player.inventory.append(self.items[item_index])
-        # Add item to player's inventory in Firestore
-        db.collection('players').document(player.name).collection('items').add(
-            self.items[item_index].to_dict()
-        )
-        player.save_to_db(db)  # Ensure player data, including doubloons and inventory, is saved in the database
-        return self.items[item_index].name
\ No newline at end of file
+        player.doubloons -= total_cost
+        # Add the items to the player's stack; doubloons and items go out in one write to the player document
+        player.add_to_items(item, db, quantity)
+        return item.name
+
+
+class ShopCatalog:
+    def __init__(self, path=SHOP_ITEMS_PATH, reload_interval=SHOP_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._mtime = os.stat(path).st_mtime
+        self._shop = Shop.load(path)
+        self._checked_at = time.monotonic()
+
+    def current(self):
+        """
+        Return the current Shop, reloading it first if the data file changed since the last check.
+        """
+        now = time.monotonic()
+        if now - self._checked_at >= self.reload_interval:
+            self._checked_at = now
+            self._reload_if_changed()
+        return self._shop
+
+    def _reload_if_changed(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if mtime == self._mtime:
+                return
+            self._shop = Shop.load(self.path)
+            self._mtime = mtime
+            print(f"Reloaded shop catalog: {len(self._shop.items)} items")
+        except (OSError, ValueError, TypeError) as e:
+            # A half-written or broken file keeps the previous catalog; it is retried on the next check
+            print(f"Could not reload the shop catalog: {e}")
+
+
+def find_item(name):
+    """
+    Look up an item the shop sells by name, or None if it doesn't sell it.
+    """
+    return shop_catalog.current().find(name)
+
+
+shop_catalog = ShopCatalog()
@@ -0,0 +1,168 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from treasure import Treasure
+
+# Offline balance simulator. Reproduces a dungeon run without the LLM or Firestore: the encounter weights of
+# Dungeon.roll_encounter, threat escalation from Dungeon.update_threat_level, the rounds of
+# combat.resolve_combat and the treasure rarity roll of Treasure. Every step is vectorized across a chunk of
+# runs, and chunks run on a process pool. Keep the formulas here in step with the game code they mirror.
+#
+#   python simulate.py --runs 1000000 --multiplier 1.5 --max-threat 5
+
+ENCOUNTERS = ["combat", "treasure", "nothing", "escape"]
+COMBAT, TREASURE, NOTHING, ESCAPE = range(len(ENCOUNTERS))
+RARITY_VALUES = np.array([index * 10 for index in range(len(Treasure.rarity_levels))])
+
+
+class SimulationParams:
+    def __init__(self, multiplier=1.5, max_threat=5, start_threat=1, health=100, max_base_damage=10,
+                 max_depth=50, escape_depth=5):
+        self.multiplier = multiplier
+        self.max_threat = max_threat
+        self.start_threat = start_threat
+        self.health = health
+        self.max_base_damage = max_base_damage
+        self.max_depth = max_depth
+        self.escape_depth = escape_depth  # the player takes the first escape room at or beyond this depth
+
+
+def encounter_weights(threat):
+    """
+    The weights of Dungeon.roll_encounter for an array of threat levels, one row per run.
+    """
+    return np.stack([
+        threat,
+        np.maximum(1, 10 - threat),
+        np.maximum(1, 5 - threat),
+        np.maximum(1, 10 - threat),
+    ], axis=1)
+
+
+def fight(rng, health, threat, max_base_damage):
+    """
+    Vectorized combat.resolve_combat without armor. Returns the players' health after the fight.
+    """
+    enemy_health = threat.copy()
+    enemy_max_attack = threat.astype(np.int64)
+    fighting = (health > 0) & (enemy_health > 0)
+    while fighting.any():
+        player_attack = rng.integers(0, max_base_damage + 1, size=len(health))
+        enemy_attack = rng.integers(0, enemy_max_attack + 1)
+        enemy_health = np.where(fighting, enemy_health - player_attack, enemy_health)
+        hit = fighting & (enemy_health > 0)
+        health = np.where(hit, np.maximum(health - enemy_attack, 0), health)
+        fighting &= (health > 0) & (enemy_health > 0)
+    return health
+
+
+def simulate_chunk(runs, seed, params):
+    """
+    Simulate runs dungeon runs. Returns deaths per depth, escapes per depth, and total doubloons and XP.
+    Doubloons are the value of the treasures carried out of an escape; dying loses them.
+    """
+    rng = np.random.default_rng(seed)
+    health = np.full(runs, params.health, dtype=np.int64)
+    threat = np.full(runs, params.start_threat, dtype=np.float64)
+    active = np.ones(runs, dtype=bool)
+    treasure_value = np.zeros(runs, dtype=np.int64)
+    experience = np.zeros(runs, dtype=np.int64)
+    deaths = np.zeros(params.max_depth + 1, dtype=np.int64)
+    escapes = np.zeros(params.max_depth + 1, dtype=np.int64)
+    doubloons = 0
+
+    for depth in range(1, params.max_depth + 1):
+        if not active.any():
+            break
+        cumulative = encounter_weights(threat).cumsum(axis=1)
+        draw = rng.random(runs) * cumulative[:, -1]
+        encounter = (draw[:, None] >= cumulative).sum(axis=1)
+
+        in_combat = active & (encounter == COMBAT)
+        if in_combat.any():
+            after = fight(rng, health[in_combat], threat[in_combat], params.max_base_damage)
+            won = after > 0
+            health[in_combat] = after
+            experience[in_combat] += np.where(won, np.round(threat[in_combat]).astype(np.int64), 0)
+            died = np.zeros(runs, dtype=bool)
+            died[in_combat] = ~won
+            deaths[depth] += died.sum()
+            treasure_value[died] = 0
+            active &= ~died
+
+        found = active & (encounter == TREASURE)
+        treasure_value[found] += RARITY_VALUES[rng.integers(0, len(RARITY_VALUES), size=found.sum())]
+
+        escaped = active & (encounter == ESCAPE) & (depth >= params.escape_depth)
+        escapes[depth] += escaped.sum()
+        doubloons += treasure_value[escaped].sum()
+        active &= ~escaped
+
+        threat = np.minimum(threat * params.multiplier, params.max_threat)
+
+    # Runs still going at max_depth are counted as escaping there with what they carry
+    escapes[params.max_depth] += active.sum()
+    doubloons += treasure_value[active].sum()
+    return deaths, escapes, int(doubloons), int(experience.sum())
+
+
+def simulate(runs, params, seed=0, workers=None, chunk_size=100_000):
+    """
+    Split runs into chunks with independent random streams and simulate them on a process pool.
+    """
+    chunks = [min(chunk_size, runs - start) for start in range(0, runs, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    deaths = np.zeros(params.max_depth + 1, dtype=np.int64)
+    escapes = np.zeros(params.max_depth + 1, dtype=np.int64)
+    doubloons = experience = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for chunk_deaths, chunk_escapes, chunk_doubloons, chunk_experience in pool.map(
+                simulate_chunk, chunks, seeds, [params] * len(chunks)):
+            deaths += chunk_deaths
+            escapes += chunk_escapes
+            doubloons += chunk_doubloons
+            experience += chunk_experience
+
+    return {
+        'runs': runs,
+        # Fraction of runs not dead after each depth (escaped runs count as survivors)
+        'survival_by_depth': 1 - deaths.cumsum()[1:] / runs,
+        'deaths_by_depth': deaths[1:],
+        'escapes_by_depth': escapes[1:],
+        'expected_doubloons': doubloons / runs,
+        'expected_experience': experience / runs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Monte Carlo balance simulation of whole dungeon runs.")
+    parser.add_argument("--runs", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--multiplier", type=float, default=1.5, help="threat_level_multiplier")
+    parser.add_argument("--max-threat", type=float, default=5, help="max_threat_level")
+    parser.add_argument("--max-base-damage", type=int, default=10)
+    parser.add_argument("--max-depth", type=int, default=50)
+    parser.add_argument("--escape-depth", type=int, default=5, help="take the first escape room from this depth")
+    args = parser.parse_args()
+
+    params = SimulationParams(multiplier=args.multiplier, max_threat=args.max_threat,
+                              max_base_damage=args.max_base_damage, max_depth=args.max_depth,
+                              escape_depth=args.escape_depth)
+    report = simulate(args.runs, params, seed=args.seed, workers=args.workers)
+
+    print(f"{report['runs']} runs")
+    print(f"Expected doubloons per run: {report['expected_doubloons']:.2f}")
+    print(f"Expected XP per run: {report['expected_experience']:.2f}")
+    print("depth  survival  deaths  escapes")
+    for depth, (survival, died, escaped) in enumerate(zip(report['survival_by_depth'], report['deaths_by_depth'],
+                                                          report['escapes_by_depth']), start=1):
+        if died or escaped:
+            print(f"{depth:5}  {survival:8.4f}  {died:6}  {escaped:7}")
+
+
+if __name__ == "__main__":
+    main()
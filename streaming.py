@@ -0,0 +1,48 @@
+import time
+
+# Narratives are shown while they are generated: the first chunk is sent as a follow-up message and later
+# chunks are applied by editing it. Edits are throttled so a burst of tokens does not run into Discord's
+# rate limits, and text past the 2000 character message limit continues in a new follow-up message.
+
+DISCORD_MESSAGE_LIMIT = 2000
+EDIT_INTERVAL = 1.2  # seconds between edits of the same reply
+
+
+class StreamedReply:
+    def __init__(self, interaction, edit_interval=EDIT_INTERVAL):
+        self.interaction = interaction
+        self.edit_interval = edit_interval
+        self.text = ""
+        self.messages = []  # follow-up messages sent so far
+        self.shown = []  # content currently displayed by each message
+        self.last_flush = 0.0
+
+    def _pages(self):
+        return [self.text[i:i + DISCORD_MESSAGE_LIMIT] for i in range(0, len(self.text), DISCORD_MESSAGE_LIMIT)]
+
+    async def feed(self, chunk):
+        self.text += chunk
+        if time.monotonic() - self.last_flush >= self.edit_interval:
+            await self.flush()
+
+    async def flush(self):
+        self.last_flush = time.monotonic()
+        for index, page in enumerate(self._pages()):
+            if not page.strip():
+                continue
+            if index < len(self.messages):
+                if self.shown[index] != page:
+                    await self.messages[index].edit(content=page)
+                    self.shown[index] = page
+            else:
+                self.messages.append(await self.interaction.followup.send(content=page, wait=True))
+                self.shown.append(page)
+
+    async def relay(self, chunks):
+        """
+        Show every chunk of an async iterator, then make sure the final text is displayed.
+        """
+        async for chunk in chunks:
+            await self.feed(chunk)
+        await self.flush()
+        return self.text
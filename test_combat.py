@@ -0,0 +1,63 @@
+import random
+
+from combat import resolve_combat
+
+
+class ScriptedRolls:
+    """
+    Stands in for random: randint returns the scripted rolls in order, player attack first in each round.
+    """
+
+    def __init__(self, rolls):
+        self.rolls = iter(rolls)
+
+    def randint(self, low, high):
+        roll = next(self.rolls)
+        assert low <= roll <= high
+        return roll
+
+
+def test_won_fight():
+    outcome = resolve_combat(100, 10, 5, rng=ScriptedRolls([3, 2, 4, 5]))
+    assert outcome.rounds == [(3, 2, 2, 98), (4, 5, None, 98)]
+    assert outcome.won and not outcome.died
+    assert outcome.final_health == 98
+    assert outcome.experience == 5
+    assert outcome.damage_dealt == 7
+    assert outcome.damage_taken == 2
+
+
+def test_lost_fight():
+    outcome = resolve_combat(3, 10, 5, rng=ScriptedRolls([0, 2, 1, 4]))
+    assert outcome.rounds == [(0, 2, 2, 1), (1, 4, 4, 0)]
+    assert outcome.died and not outcome.won
+    assert outcome.final_health == 0
+    assert outcome.experience == 0
+    assert outcome.damage_taken == 6
+
+
+def test_armor_never_heals():
+    outcome = resolve_combat(50, 10, 5, armor_defense=10, rng=ScriptedRolls([1, 5, 10, 0]))
+    assert outcome.rounds == [(1, 5, 0, 50), (10, 0, None, 50)]
+    assert outcome.final_health == 50
+
+
+def test_fractional_threat_level():
+    outcome = resolve_combat(100, 10, 3.375, rng=random.Random(7))
+    assert outcome.won
+    assert outcome.experience == 3
+    assert outcome.final_health == outcome.rounds[-1][3]
+    assert all(enemy_attack <= 3 for _, enemy_attack, _, _ in outcome.rounds)
+
+
+def test_render_lists_every_round():
+    outcome = resolve_combat(100, 10, 5, rng=ScriptedRolls([3, 2, 4, 5]))
+    assert outcome.render() == (
+        "You took 2 damage and have 98 health remaining.\n"
+        "Player dealt 3 damage to the enemy.\n"
+        "Enemy dealt 2 damage to the player.\n"
+        "---\n"
+        "Player dealt 4 damage to the enemy.\n"
+        "Enemy dealt 5 damage to the player.\n"
+        "---\n"
+    )
@@ -0,0 +1,209 @@
+import asyncio
+
+import pytest
+from google.api_core.exceptions import FailedPrecondition
+
+from session import MAX_BATCH_WRITES, DocumentProxy, StaleWrite, UnitOfWork, write_changes
+
+
+class FakeRef:
+    def __init__(self, path):
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+        self.parent = None
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, ref, data, merge=False):
+        self.writes.append(('set', ref.path, data, merge))
+
+    def update(self, ref, data, option=None):
+        if option is None:
+            self.writes.append(('update', ref.path, data))
+        else:
+            self.writes.append(('update', ref.path, data, option))
+
+    def delete(self, ref):
+        self.writes.append(('delete', ref.path))
+
+    async def commit(self):
+        for write in self.writes:
+            if write[-1] == ('last_update_time', 'edited elsewhere'):
+                raise FailedPrecondition("the document was changed")
+        self.db.commits.append(self.writes)
+        self.db.clock += 1
+        return [WriteResult(self.db.clock) for _ in self.writes]
+
+
+class WriteResult:
+    def __init__(self, update_time):
+        self.update_time = update_time
+
+
+class FakeClient:
+    """
+    Records the batches a UnitOfWork commits.
+    """
+
+    def __init__(self):
+        self.commits = []
+        self.clock = 0  # update_time of the last commit
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def write_option(self, last_update_time):
+        return ('last_update_time', last_update_time)
+
+
+class Owner:
+    def __init__(self, update_time=None):
+        self.update_time = update_time
+
+
+def staged(session, path):
+    """
+    A document reference that stages its writes in the session, like UnitOfWork.collection(...).document(...).
+    """
+    return DocumentProxy(session, FakeRef(path))
+
+
+def commit(session):
+    asyncio.run(session.commit())
+    return session.db.commits
+
+
+@pytest.fixture
+def session():
+    return UnitOfWork(FakeClient())
+
+
+def test_writes_to_one_document_fold_into_one(session):
+    ref = FakeRef('players/bob')
+    session.set(ref, {'health': 100, 'doubloons': 0})
+    session.update(ref, {'doubloons': 10})
+    session.update(ref, {'health': 90})
+    assert commit(session) == [[('set', 'players/bob', {'health': 90, 'doubloons': 10}, False)]]
+
+
+def test_updates_merge(session):
+    ref = FakeRef('players/bob')
+    session.update(ref, {'health': 90})
+    session.update(ref, {'doubloons': 10})
+    assert commit(session) == [[('update', 'players/bob', {'health': 90, 'doubloons': 10})]]
+
+
+def test_merge_set_into_update_stays_an_update(session):
+    ref = FakeRef('players/bob')
+    session.update(ref, {'health': 90})
+    session.set(ref, {'doubloons': 10}, merge=True)
+    assert commit(session) == [[('update', 'players/bob', {'health': 90, 'doubloons': 10})]]
+
+
+def test_set_without_merge_replaces(session):
+    ref = FakeRef('players/bob')
+    session.update(ref, {'health': 90})
+    session.set(ref, {'doubloons': 10})
+    assert commit(session) == [[('set', 'players/bob', {'doubloons': 10}, False)]]
+
+
+def test_delete_wins_over_earlier_writes(session):
+    ref = FakeRef('dungeons/bob')
+    session.set(ref, {'depth': 3})
+    session.delete(ref)
+    assert commit(session) == [[('delete', 'dungeons/bob')]]
+
+
+def test_writes_after_delete_replace_it(session):
+    ref = FakeRef('dungeons/bob')
+    session.delete(ref)
+    session.set(ref, {'depth': 0}, merge=True)
+    assert commit(session) == [[('set', 'dungeons/bob', {'depth': 0}, False)]]
+
+
+def test_documents_are_kept_apart(session):
+    session.update(FakeRef('players/bob'), {'health': 90})
+    session.update(FakeRef('players/alice'), {'health': 80})
+    assert session.pending_writes == 2
+    assert commit(session) == [[('update', 'players/bob', {'health': 90}),
+                                ('update', 'players/alice', {'health': 80})]]
+    assert session.pending_writes == 0
+
+
+def test_large_commits_are_split(session):
+    for index in range(MAX_BATCH_WRITES + 1):
+        session.delete(FakeRef(f'treasures/{index}'))
+    assert [len(batch) for batch in commit(session)] == [MAX_BATCH_WRITES, 1]
+
+
+def test_delete_collection_drops_staged_documents(session):
+    session.update(FakeRef('treasures/a'), {'value': 10})
+    session.update(FakeRef('players/bob'), {'health': 90})
+    session.delete_collection(FakeRef('treasures'))
+    assert list(session._writes) == ['players/bob']
+
+
+def test_discard(session):
+    session.update(FakeRef('players/bob'), {'health': 90})
+    session.discard()
+    assert commit(session) == []
+
+
+def test_commit_guarded_refuses_collection_deletes(session):
+    session.delete_collection(FakeRef('treasures'))
+    with pytest.raises(ValueError):
+        asyncio.run(session.commit_guarded(FakeRef('players/bob'), {}))
+
+
+def test_write_changes_sets_new_documents(session):
+    persisted, changed = write_changes(staged(session, 'players/bob'), None, {'health': 100}, merge=True)
+    assert persisted == {'health': 100}
+    assert changed == ['health']
+    assert commit(session) == [[('set', 'players/bob', {'health': 100}, True)]]
+
+
+def test_write_changes_skips_unchanged_documents(session):
+    persisted = {'health': 100, 'doubloons': 5}
+    new_persisted, changed = write_changes(staged(session, 'players/bob'), persisted, dict(persisted))
+    assert changed == []
+    assert new_persisted == persisted
+    assert session.pending_writes == 0
+
+
+def test_write_changes_sends_only_changed_fields(session):
+    persisted = {'health': 100, 'doubloons': 5}
+    new_persisted, changed = write_changes(staged(session, 'players/bob'), persisted,
+                                           {'health': 90, 'doubloons': 5, 'exp': 1})
+    assert sorted(changed) == ['exp', 'health']
+    assert new_persisted == {'health': 90, 'doubloons': 5, 'exp': 1}
+    assert commit(session) == [[('update', 'players/bob', {'health': 90, 'exp': 1})]]
+
+
+def test_updates_from_a_read_copy_carry_its_update_time(session):
+    player = Owner(update_time=7)
+    write_changes(staged(session, 'players/bob'), {'health': 100}, {'health': 90}, owner=player)
+    assert commit(session) == [[('update', 'players/bob', {'health': 90}, ('last_update_time', 7))]]
+    assert player.update_time == 1
+
+
+def test_owner_follows_its_writes(session):
+    player = Owner()
+    persisted, _ = write_changes(staged(session, 'players/bob'), None, {'health': 100}, owner=player)
+    commit(session)
+    assert player.update_time == 1
+    write_changes(staged(session, 'players/bob'), persisted, {'health': 90}, owner=player)
+    assert commit(session)[-1] == [('update', 'players/bob', {'health': 90}, ('last_update_time', 1))]
+    assert player.update_time == 2
+
+
+def test_changes_made_elsewhere_are_not_overwritten(session):
+    player = Owner(update_time='edited elsewhere')
+    write_changes(staged(session, 'players/bob'), {'health': 100}, {'health': 90}, owner=player)
+    with pytest.raises(StaleWrite):
+        asyncio.run(session.commit())
+    assert session.pending_writes == 1
+    assert player.update_time == 'edited elsewhere'
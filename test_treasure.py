@@ -0,0 +1,41 @@
+import pytest
+
+from treasure import Treasure, pack_inventory, unpack_inventory
+
+
+def test_round_trip_every_treasure():
+    treasures = list(Treasure.catalog.values())
+    assert unpack_inventory(pack_inventory(treasures)) == treasures
+
+
+def test_round_trip_keeps_order_and_duplicates():
+    jewel = Treasure("jewel", "gold", "dwarven", "Common")
+    scroll = Treasure("scroll", "ruby", "elvish", "Rare")
+    treasures = [scroll, jewel, scroll, scroll]
+    assert unpack_inventory(pack_inventory(treasures)) == treasures
+
+
+def test_empty_inventory():
+    assert pack_inventory([]) == b"\x01"
+    assert unpack_inventory(b"\x01") == []
+    # Players saved before they found anything have no field at all
+    assert unpack_inventory(None) == []
+    assert unpack_inventory(b"") == []
+
+
+def test_format_1_bytes():
+    # Written by the first version of the packed inventory; the tables are append-only, so these must
+    # keep decoding to the same treasures
+    stored = b"\x01" + b"\x00\x00\x00\x00" + b"\x04\x03\x02\x04" + b"\x02\x01\x01\x02"
+    treasures = [
+        Treasure("jewel", "gold", "dwarven", "Common"),
+        Treasure("grimoire", "ruby", "dragon hoard", "Legendary"),
+        Treasure("scroll", "silver", "elvish", "Rare"),
+    ]
+    assert unpack_inventory(stored) == treasures
+    assert pack_inventory(treasures) == stored
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        unpack_inventory(b"\x02\x00\x00\x00\x00")
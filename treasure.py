@@ -1,39 +1,66 @@
+import itertools
 import random
-import json
-from uuid import uuid4
+import struct
+
+# Inventories are stored on the player document as a single bytes field: a format byte followed by 4 bytes per
+# treasure, its code. A code packs the indexes of the treasure's type, material, origin and rarity in the tables
+# below, one byte each. Value and defense follow from the type and rarity, so they are not stored. The tables
+# are append-only: reordering them would change the meaning of every stored inventory.
+INVENTORY_FORMAT = 1
+TREASURE_TYPES = ["jewel", "artifact", "scroll", "potion", "grimoire"]
+MATERIALS = ["gold", "silver", "diamond", "ruby"]
+ORIGINS = ["dwarven", "elvish", "dragon hoard"]
 
 class Treasure:
+    """
+    A kind of treasure. Every combination of type, material, origin and rarity is built once at import, with its
+    value, defense value, display string and use() text worked out in advance, and kept in Treasure.catalog.
+    Treasure(...) returns the catalog entry, and inventories hold references to it. Treat them as immutable.
+    """
+    __slots__ = ('treasure_type', 'material', 'origin', 'rarity', 'value', 'defense_value', 'code', 'display', 'use_text')
     # A class to represent different types of treasures
     rarity_levels = ['Common', 'Uncommon', 'Rare', 'Very rare', 'Legendary']
-    def __init__(self, treasure_type, material, origin, id=None):
-        self.treasure_type = treasure_type  # e.g., jewel, artifact, scroll, potion, grimoire
-        self.material = material  # e.g., gold, silver, diamond, ruby
-        self.origin = origin  # e.g., dwarven, elvish, dragon hoard
-        self.rarity = random.choice(self.rarity_levels)
-        self.value = self.rarity_levels.index(self.rarity) * 10  # set the value based on rarity, adjust as needed
-        self.id = id if id else str(uuid4()) 
-
+    catalog = {}  # code -> Treasure
 
+    def __new__(cls, treasure_type, material, origin, rarity=None, rng=random):
+        if rarity is None:
+            rarity = rng.choice(cls.rarity_levels)
+        return cls.catalog[treasure_code(treasure_type, material, origin, rarity)]
 
+    @classmethod
+    def _build(cls, treasure_type, material, origin, rarity):
+        treasure = super().__new__(cls)
+        treasure.treasure_type = treasure_type  # e.g., jewel, artifact, scroll, potion, grimoire
+        treasure.material = material  # e.g., gold, silver, diamond, ruby
+        treasure.origin = origin  # e.g., dwarven, elvish, dragon hoard
+        treasure.rarity = rarity
+        treasure.value = cls.rarity_levels.index(rarity) * 10  # set the value based on rarity, adjust as needed
         # if generated treasure is armor, set the defense value  based off rarity
         if treasure_type == 'armor':
-            self.defense_value = self.rarity_levels.index(self.rarity) * 10
+            treasure.defense_value = cls.rarity_levels.index(rarity) * 10
         else:
-            self.defense_value = None
-        
-    def __str__(self):
-        return f"{self.rarity} {self.material.capitalize()} {self.treasure_type.capitalize()} of {self.origin.capitalize()} origin valued at {self.value} doubloons"
-        
-    def use(self):
+            treasure.defense_value = None
+        treasure.code = treasure_code(treasure_type, material, origin, rarity)
+        treasure.display = f"{rarity} {material.capitalize()} {treasure_type.capitalize()} of {origin.capitalize()} origin valued at {treasure.value} doubloons"
         # A method to use or activate the treasure and apply its effects
         # This is a basic example; you can expand this based on your game's mechanics
-        if self.treasure_type == "scroll":
-            return "You unrolled the scroll and read the mystical writings."
-        elif self.treasure_type == "potion":
-            return "You drank the potion. You feel its magical energy course through your body."
-        else:       
-            return f"You used the {self.material} {self.treasure_type}. Its {self.rarity} rarity sparkles with the mystique of its {self.origin} origin."
-    
+        if treasure_type == "scroll":
+            treasure.use_text = "You unrolled the scroll and read the mystical writings."
+        elif treasure_type == "potion":
+            treasure.use_text = "You drank the potion. You feel its magical energy course through your body."
+        else:
+            treasure.use_text = f"You used the {material} {treasure_type}. Its {rarity} rarity sparkles with the mystique of its {origin} origin."
+        return treasure
+
+    @staticmethod
+    def from_code(code):
+        return Treasure.catalog[code]
+
+    def __str__(self):
+        return self.display
+
+    def use(self):
+        return self.use_text
 
     def to_dict(self):
         """
@@ -46,20 +73,55 @@ class Treasure:
             "rarity": self.rarity,
             "value": self.value,
             "defense_value": self.defense_value,
-            "id": self.id
         }
 
     @staticmethod
     def from_dict(data):
-        treasure = Treasure(
+        if data.get("rarity") is None:
+            raise ValueError(f"Treasure without a rarity: {data}")
+        return Treasure(
             treasure_type = data.get("treasure_type"),
             material = data.get("material"),
             origin = data.get("origin"),
-            id = data.get("id")
+            rarity = data.get("rarity"),
         )
-        # The other fields are assign separately because these are not part of init
-        treasure.rarity = data.get("rarity")
-        treasure.value = data.get("value")
-        treasure.defense_value = data.get("defense_value")
-        treasure.id = data.get("id")
-        return treasure      
+
+
+# Each attribute's index, already shifted into its byte of the code
+_TYPE_CODES = {name: index << 24 for index, name in enumerate(TREASURE_TYPES)}
+_MATERIAL_CODES = {name: index << 16 for index, name in enumerate(MATERIALS)}
+_ORIGIN_CODES = {name: index << 8 for index, name in enumerate(ORIGINS)}
+_RARITY_CODES = {name: index for index, name in enumerate(Treasure.rarity_levels)}
+
+
+def treasure_code(treasure_type, material, origin, rarity):
+    try:
+        return (_TYPE_CODES[treasure_type] | _MATERIAL_CODES[material]
+                | _ORIGIN_CODES[origin] | _RARITY_CODES[rarity])
+    except KeyError as e:
+        raise ValueError(f"Unknown treasure attribute: {e}") from None
+
+
+Treasure.catalog.update(
+    (treasure.code, treasure) for treasure in
+    (Treasure._build(*attributes)
+     for attributes in itertools.product(TREASURE_TYPES, MATERIALS, ORIGINS, Treasure.rarity_levels))
+)
+
+
+def pack_inventory(treasures):
+    """
+    Encode a list of treasures into the bytes stored in the player document's 'treasures' field.
+    """
+    return bytes([INVENTORY_FORMAT]) + struct.pack(f">{len(treasures)}I", *[treasure.code for treasure in treasures])
+
+
+def unpack_inventory(packed):
+    """
+    Decode the player document's 'treasures' field back into Treasure objects.
+    """
+    if not packed:
+        return []
+    if packed[0] != INVENTORY_FORMAT:
+        raise ValueError(f"Unknown inventory format: {packed[0]}")
+    return [Treasure.from_code(code) for (code,) in struct.iter_unpack(">I", memoryview(packed)[1:])]